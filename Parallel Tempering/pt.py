@@ -7,6 +7,7 @@
 import numpy as np
 import numba as nb
 import time
+from scipy.sparse import csr_matrix, issparse
 
 
 # %%
@@ -55,26 +56,277 @@ def default_temp_schedule(num_iter, temp_start, decay_rate, mode='EXPONENTIAL'):
         raise ValueError("mode not supported")
 
 
+# %%
+def sparse_neighbour_lists(Q):
+    """
+    Splits a sparse matrix into the neighbour lists used by the sparse solvers.
+    
+    Parameters:
+        Q (scipy.sparse matrix of float64): The matrix representing the local and coupling field of the problem.
+    
+    Return: indptr, indices, data (CSR arrays of the symmetrized off-diagonal couplings), diag (1-D array of float64, local fields)
+    """
+    
+    Q = csr_matrix(0.5*(Q + Q.T), dtype=np.float64) # making sure Q is symmetric
+    diag = Q.diagonal()
+    Q.setdiag(0)
+    Q.eliminate_zeros()
+    Q.sort_indices()
+    return Q.indptr, Q.indices, Q.data, diag
+
+
+# %%
+@nb.njit(parallel=False)
+def _PT_sparse_kernel(indptr, indices, data, diag, num_iter, re_intv, temp_seq, replicas, houdayer_intv=0, stats=None, stats_intv=1):
+    """
+    Compiled loop of one_PT_run for sparse Q given as neighbour lists.
+    replicas (2-D array of bool, one replica per row) is updated in place. It holds L ladders of M = len(temp_seq) replicas each.
+    Each replica keeps its local fields field[i] = sum(Q[i, j] for j != i if state[j]), so a proposal costs O(1) and an accepted flip O(degree).
+    Replica exchanges, one attempt per ladder, swap entries of temp_to_rep instead of copying states.
+    With two ladders and houdayer_intv > 0, a Houdayer cluster move is made at every temperature once every houdayer_intv iterations:
+    a connected cluster of the spins where the two replicas differ is grown by BFS from a random such spin and swapped between them.
+    The move leaves the sum of the two energies unchanged and is therefore always accepted.
+    If stats is not None, stats[w, t] counts the accepted local moves at temperature t in window w and stats[w, M] is the lowest energy at its end.
+    
+    Return: temp_to_rep (replica index per ladder and temperature), energies (per replica),
+            exch (attempted and accepted exchanges per pair), clusters (number of cluster moves and total size of the clusters)
+    """
+    
+    R, N = replicas.shape
+    M = temp_seq.shape[0]
+    L = R // M # number of ladders
+    
+    fields = np.zeros((R, N))
+    energies = np.zeros(R)
+    for r in range(R):
+        for i in range(N):
+            for p in range(indptr[i], indptr[i+1]):
+                if replicas[r, indices[p]]:
+                    fields[r, i] += data[p]
+            if replicas[r, i]:
+                energies[r] += diag[i] + fields[r, i]
+    
+    temp_to_rep = np.arange(R).reshape((L, M))
+    exch = np.zeros((2, M-1), dtype=np.int64)
+    clusters = np.zeros(2, dtype=np.int64)
+    in_cluster = np.zeros(N, dtype=np.bool_)
+    queue = np.empty(N, dtype=np.int64)
+    
+    for i in range(num_iter):
+        for l in range(L):
+            for t in range(M):
+                r = temp_to_rep[l, t]
+                flip = np.random.randint(N)
+                sgn = 1 - 2*replicas[r, flip] # +1 if the bit is switched on, -1 if switched off
+                delta_E = sgn * (2 * fields[r, flip] + diag[flip])
+                if np.random.binomial(1, np.minimum(np.exp(-delta_E/temp_seq[t]), 1.)): # local move
+                    replicas[r, flip] ^= True
+                    energies[r] += delta_E
+                    for p in range(indptr[flip], indptr[flip+1]):
+                        fields[r, indices[p]] += sgn * data[p]
+                    if stats is not None:
+                        stats[i // stats_intv, t] += 1
+        
+        if (i+1) % re_intv == 0: # only happens once every re_intv iterations
+            for l in range(L):
+                s = np.random.randint(M-1) # exchange between temperatures s and s+1 are chosen randomly, can be changed
+                a = temp_to_rep[l, s]
+                b = temp_to_rep[l, s+1]
+                exch[0, s] += 1
+                if np.random.binomial(1, np.minimum(np.exp((energies[a] - energies[b]) * (1/temp_seq[s] - 1/temp_seq[s+1])), 1.)):
+                    temp_to_rep[l, s] = b
+                    temp_to_rep[l, s+1] = a
+                    exch[1, s] += 1
+        
+        if L == 2 and houdayer_intv > 0 and (i+1) % houdayer_intv == 0:
+            for t in range(M):
+                a = temp_to_rep[0, t]
+                b = temp_to_rep[1, t]
+                
+                # pick a random spin among those where the two replicas differ
+                num_diff = 0
+                for v in range(N):
+                    if replicas[a, v] != replicas[b, v]:
+                        num_diff += 1
+                if num_diff == 0:
+                    continue
+                k = np.random.randint(num_diff)
+                for v in range(N):
+                    if replicas[a, v] != replicas[b, v]:
+                        if k == 0:
+                            break
+                        k -= 1
+                
+                # grow the cluster by BFS over the coupling graph, restricted to differing spins
+                in_cluster[v] = True
+                queue[0] = v
+                head = 0
+                tail = 1
+                while head < tail:
+                    v = queue[head]
+                    head += 1
+                    for p in range(indptr[v], indptr[v+1]):
+                        u = indices[p]
+                        if not in_cluster[u] and replicas[a, u] != replicas[b, u]:
+                            in_cluster[u] = True
+                            queue[tail] = u
+                            tail += 1
+                
+                # swap the cluster between the two replicas, i.e. flip it in both
+                for q in range(tail):
+                    v = queue[q]
+                    in_cluster[v] = False
+                    for r in (a, b):
+                        sgn = 1 - 2*replicas[r, v]
+                        energies[r] += sgn * (2 * fields[r, v] + diag[v])
+                        replicas[r, v] ^= True
+                        for p in range(indptr[v], indptr[v+1]):
+                            fields[r, indices[p]] += sgn * data[p]
+                clusters[0] += 1
+                clusters[1] += tail
+        
+        if stats is not None:
+            if (i+1) % stats_intv == 0 or i+1 == num_iter:
+                stats[i // stats_intv, M] = np.min(energies)
+    
+    return temp_to_rep, energies, exch, clusters
+
+
+# %%
+def _PT_stats(num_iter, stats_intv, temp_seq, local_accepted, exch_attempted, exch_accepted, min_energy, total_time, num_ladders=1, clusters=None, k0=0):
+    """
+    The dict of run statistics returned by one_PT_run with return_stats=True.
+    For a run resumed at iteration k0, the counters and the speed cover only the resumed part.
+    """
+    
+    M = len(temp_seq)
+    num_win = len(min_energy)
+    win_len = num_ladders * np.minimum(stats_intv, num_iter - stats_intv * np.arange(num_win))
+    stats = {
+        'solver': 'PT',
+        'stats_intv': stats_intv,
+        'step': np.minimum(stats_intv * np.arange(1, num_win+1), num_iter),
+        'temp_seq': np.asarray(temp_seq, dtype=np.float64),
+        'accept_rate': local_accepted / win_len[:, None], # shape (windows, temperatures)
+        'exchange_attempted': exch_attempted,
+        'exchange_rate': exch_accepted / np.maximum(exch_attempted, 1),
+        'energy': min_energy, # lowest replica energy at the end of each window
+        'num_proposals': (num_iter - k0) * M * num_ladders,
+        'num_accepted': int(np.sum(local_accepted)),
+        'time': total_time,
+        'flips_per_sec': (num_iter - k0) * M * num_ladders / total_time,
+    }
+    if clusters is not None:
+        stats['cluster_moves'] = int(clusters[0])
+        stats['mean_cluster_size'] = clusters[1] / max(clusters[0], 1)
+    return stats
+
+
+# %%
+@nb.njit(parallel=False)
+def _seed_numba(sd):
+    """
+    Seeds the rng used inside compiled functions, which is separate from numpy's.
+    """
+    
+    np.random.seed(sd)
+
+
+# %%
+def _one_PT_sparse_run(Q, num_iter, re_intv, temp_seq, state, return_stats, stats_intv, houdayer_intv, checkpoint=None, resume=None):
+    """
+    one_PT_run for a scipy.sparse Q. Replicas are stored as one (M, N) array of bool, or (2M, N) with Houdayer moves.
+    With checkpoint or resume, the kernel runs in chunks of checkpoint.intv iterations and the compiled rng is reseeded from base_seed
+    at the start of every chunk, since its state cannot be saved. Between chunks the replicas are sorted by temperature.
+    """
+    
+    problem = sparse_neighbour_lists(Q)
+    temp_seq = np.asarray(temp_seq, dtype=np.float64)
+    M = len(temp_seq)
+    L = 2 if houdayer_intv > 0 else 1 # Houdayer moves need two replicas per temperature
+    replicas = np.tile(state, (L*M, 1)) # all replicas start from the same initial state, can be changed
+    if L == 2:
+        replicas[M:] = np.random.binomial(1, 0.5, (M, len(state))) == 1 # identical replicas would have no cluster to swap
+    
+    k0 = 0
+    stats = np.zeros((-(-num_iter // stats_intv), M+1)) if return_stats else None
+    start_time = time.perf_counter()
+    
+    if checkpoint is None and resume is None:
+        _, energies, exch, clusters = _PT_sparse_kernel(*problem, num_iter, re_intv, temp_seq, replicas, houdayer_intv, stats, stats_intv)
+    else:
+        if resume is not None:
+            k0, replicas, base_seed, intv = resume['step'], resume['replicas'].copy(), resume['base_seed'], resume['intv']
+        else:
+            base_seed, intv = np.random.randint(2**31), checkpoint.intv
+        if checkpoint is not None and checkpoint.intv != intv:
+            raise ValueError("checkpoint.intv differs from the interrupted run")
+        if intv % re_intv != 0 or (L == 2 and intv % houdayer_intv != 0) or (return_stats and intv % stats_intv != 0):
+            raise ValueError("checkpoint intv should be a multiple of re_intv, houdayer_intv and stats_intv")
+        
+        exch = np.zeros((2, M-1), dtype=np.int64)
+        clusters = np.zeros(2, dtype=np.int64)
+        for lo in range(k0, num_iter, intv):
+            hi = min(lo + intv, num_iter)
+            _seed_numba(base_seed + lo)
+            temp_to_rep, energies, chunk_exch, chunk_clusters = _PT_sparse_kernel(
+                *problem, hi - lo, re_intv, temp_seq, replicas, houdayer_intv,
+                None if stats is None else stats[lo // stats_intv:], stats_intv)
+            replicas, energies = replicas[temp_to_rep.ravel()], energies[temp_to_rep.ravel()]
+            exch += chunk_exch
+            clusters += chunk_clusters
+            if checkpoint is not None and checkpoint.due(hi-1):
+                checkpoint.save(hi, replicas=replicas, base_seed=base_seed, intv=intv)
+        if checkpoint is not None:
+            checkpoint.wait()
+    
+    if not return_stats:
+        return replicas[np.argmin(energies)]
+    
+    total_time = time.perf_counter() - start_time
+    return replicas[np.argmin(energies)], _PT_stats(num_iter, stats_intv, temp_seq, stats[:, :M].astype(np.int64),
+                                                    exch[0], exch[1], stats[:, M], total_time,
+                                                    L, clusters if L == 2 else None, k0)
+
+
 # %%
 #@nb.njit(parallel=False)
-def one_PT_run(Q, num_iter, re_intv, temp_seq, ansatz_state=None):
+def one_PT_run(Q, num_iter, re_intv, temp_seq, ansatz_state=None, return_stats=False, stats_intv=100, houdayer_intv=0, checkpoint=None, resume=None):
     """
     One parallel tempering run over the specified number of steps.
     
     Parameters:
         Q (2-D array of float64): The matrix representing the local and coupling field of the problem.
+                                  A np.memmap (e.g. a .npy file opened with mmap_mode='r') is used in place, without copying it into memory,
+                                  and must therefore already be symmetric. It must be float32 or float64: the float16 and int8 files
+                                  of save_coupling in sb.py are not supported here, as int8 ones would be annealed without their scale.
+                                  A scipy.sparse matrix is run by a compiled loop on neighbour lists, at O(degree) cost per accepted flip.
         num_iter (int): The number of iteration performed in PT.
         re_intv (int): The number of local sampling iterations between replica exchanges.
                        If one replica exchange is attempted at iteration k, the next will be at iteration k + re_int.
         temp_seq (list[float64]): The annealing temperature sequence. Each temperature corresponds to a replica.
         ansatz_state (1-D array of bool, default=None): The boolean vector representing the initial state.
                                                         If None, a random state is chosen.
+        return_stats (bool, default=False): True to return a dict of run statistics additionally.
+        stats_intv (int, default=100): The number of iterations per statistics window.
+        houdayer_intv (int, default=0): If positive, two replicas are kept per temperature and a Houdayer cluster move between them
+                                        is made at every temperature once every houdayer_intv iterations (about N is a sensible start).
+                                        The second set of replicas starts from random states. Q must be a scipy.sparse matrix.
+        checkpoint (Checkpointer or None, default=None): If not None, the replicas are saved every checkpoint.intv iterations (see Utilities/checkpoint.py).
+                                                         For a sparse Q, checkpoint.intv should be a multiple of re_intv, houdayer_intv and stats_intv,
+                                                         and the compiled rng is reseeded at every checkpoint from a seed drawn from numpy.random.
+        resume (dict or None, default=None): A checkpoint from load_checkpoint to continue the run from.
+                                             All other arguments should be the same as in the interrupted run.
     
-    Return: final state of the replica with lowest energy (1-D array of bool)
+    Return: final state of the replica with lowest energy (1-D array of bool), (stats (dict))
     """
     
     # Q_coef[i][j]: local field of i if i==j; coupling strength if i!=j
-    Q = 0.5*(Q + Q.T) # making sure Q is symmetric
+    if isinstance(Q, np.memmap):
+        if Q.dtype not in (np.float32, np.float64):
+            raise ValueError("a memory-mapped Q must be float32 or float64; convert float16 or int8 files (and apply the .scale of int8 ones) first")
+    elif not issparse(Q):
+        Q = 0.5*(Q + Q.T) # making sure Q is symmetric
     N = Q.shape[0]
     M = len(temp_seq) # number of replicas
     
@@ -83,11 +335,31 @@ def one_PT_run(Q, num_iter, re_intv, temp_seq, ansatz_state=None):
     else:
         state = ansatz_state
     
+    if issparse(Q):
+        return _one_PT_sparse_run(Q, num_iter, re_intv, temp_seq, state, return_stats, stats_intv, houdayer_intv, checkpoint, resume)
+    if houdayer_intv > 0:
+        raise ValueError("Houdayer moves require a sparse Q")
+    
     replicas = [state.copy() for _ in range(M)] # all replicas start from the same initial state, can be changed
     energy = np.sum(Q.dot(state).dot(state))
     energies = [energy for _ in range(M)] # energies corresponding to replicas
+    k0 = 0
+    if resume is not None:
+        k0 = resume['step']
+        replicas = list(resume['replicas'].copy())
+        energies = resume['energies'].tolist()
+        rng_state = resume['rng']
+        np.random.set_state((rng_state[0], np.array(rng_state[1], dtype=np.uint32)) + tuple(rng_state[2:]))
     
-    for i in range(num_iter):
+    if return_stats:
+        num_win = -(-num_iter // stats_intv)
+        local_accepted = np.zeros((num_win, M), dtype=np.int64) # accepted local moves per window and temperature
+        exch_attempted = np.zeros(M-1, dtype=np.int64) # exchange attempts between temperatures s and s+1
+        exch_accepted = np.zeros(M-1, dtype=np.int64)
+        min_energy = np.zeros(num_win)
+        start_time = time.perf_counter()
+    
+    for i in range(k0, num_iter):
         for r in range(M): # parallelizable
             state = replicas[r]
             flip = np.random.randint(N)
@@ -95,14 +367,35 @@ def one_PT_run(Q, num_iter, re_intv, temp_seq, ansatz_state=None):
             if np.random.binomial(1, np.minimum(np.exp(-delta_E/temp_seq[r]), 1.)): # local move
                 state[flip] ^= True
                 energies[r] += delta_E
+                if return_stats:
+                    local_accepted[i // stats_intv, r] += 1
         
         if (i+1) % re_intv == 0: # only happens once every re_intv iterations
             s = np.random.randint(M-1) # exchange between replicas s and s+1 are chosen randomly, can be changed
+            if return_stats:
+                exch_attempted[s] += 1
             if np.random.binomial(1, np.minimum(np.exp((energies[s] - energies[s+1]) * (1/temp_seq[s] - 1/temp_seq[s+1])), 1.)):
                 replicas[s], replicas[s+1] = replicas[s+1], replicas[s]
                 energies[s], energies[s+1] = energies[s+1], energies[s]
+                if return_stats:
+                    exch_accepted[s] += 1
+        
+        if return_stats and ((i+1) % stats_intv == 0 or i+1 == num_iter):
+            min_energy[i // stats_intv] = min(energies)
+        
+        if checkpoint is not None and checkpoint.due(i):
+            rng_state = np.random.get_state()
+            checkpoint.save(i+1, replicas=np.array(replicas), energies=np.array(energies),
+                            rng=[rng_state[0], rng_state[1].tolist()] + list(rng_state[2:]))
+    
+    if checkpoint is not None:
+        checkpoint.wait()
+    best_state = replicas[energies.index(min(energies))]
     
-    return replicas[energies.index(min(energies))]
+    if return_stats:
+        total_time = time.perf_counter() - start_time
+        return best_state, _PT_stats(num_iter, stats_intv, temp_seq, local_accepted, exch_attempted, exch_accepted, min_energy, total_time, k0=k0)
+    return best_state
 
 
 # %%
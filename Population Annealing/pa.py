@@ -0,0 +1,284 @@
+# To add a new cell, type '# %%'
+# To add a new markdown cell, type '# %% [markdown]'
+# %% [markdown]
+# This notebook aims to recreate an annealer machine running population annealing.
+
+# %%
+import numpy as np
+import numba as nb
+import time
+from scipy.sparse import csr_matrix, issparse
+
+
+# %%
+def default_temp_schedule(num_iter, temp_start, decay_rate, mode='EXPONENTIAL'):
+    """
+    Generates a list of temperatures for annealing algorithms.
+    
+    Parameters:
+        num_iter (int): Length of the list.
+        temp_start (number): Value of the first element in the returned list.
+        decay_rate (number): Multiplier for changing the temperature during annealing.
+        mode (string, default='EXPONENTIAL'):
+            Three modes are possible. Note the accepted ranges for decay_rate are different.
+            'EXPONENTIAL':  T[i+1] = T[i] * (1 - decay_rate)           # 0 <= decay_rate < 1
+            'INVERSE':      T[i+1] = T[i] * (1 - decay_rate * T[i])    # 0 <= decay_rate < 1/temp_start
+            'INVERSE_ROOT': T[i+1] = T[i] * (1 - decay_rate * T[i]**2) # 0 <= decay_rate < 1/temp_start**2
+    
+    Return: temp_schedule (list[number])
+    """
+    
+    if mode == 'EXPONENTIAL':
+        if 0 <= decay_rate < 1:
+            TS = [temp_start]
+            for _ in range(num_iter - 1):
+                TS.append(TS[-1] * (1 - decay_rate))
+            return TS
+        else:
+            raise ValueError("decay_rate out of accepted range")
+    elif mode == 'INVERSE':
+        if 0 <= decay_rate < 1/temp_start:
+            TS = [temp_start]
+            for _ in range(num_iter - 1):
+                TS.append(TS[-1] * (1 - decay_rate * TS[-1]))
+            return TS
+        else:
+            raise ValueError("decay_rate out of accepted range")
+    elif mode == 'INVERSE_ROOT':
+        if 0 <= decay_rate < 1/temp_start**2:
+            TS = [temp_start]
+            for _ in range(num_iter - 1):
+                TS.append(TS[-1] * (1 - decay_rate * TS[-1]**2))
+            return TS
+        else:
+            raise ValueError("decay_rate out of accepted range")
+    else:
+        raise ValueError("mode not supported")
+
+
+# %%
+def sparse_neighbour_lists(Q):
+    """
+    Splits a sparse matrix into the neighbour lists used by the sparse solvers.
+    
+    Parameters:
+        Q (scipy.sparse matrix of float64): The matrix representing the local and coupling field of the problem.
+    
+    Return: indptr, indices, data (CSR arrays of the symmetrized off-diagonal couplings), diag (1-D array of float64, local fields)
+    """
+    
+    Q = csr_matrix(0.5*(Q + Q.T), dtype=np.float64) # making sure Q is symmetric
+    diag = Q.diagonal()
+    Q.setdiag(0)
+    Q.eliminate_zeros()
+    Q.sort_indices()
+    return Q.indptr, Q.indices, Q.data, diag
+
+
+# %%
+@nb.njit(parallel=True)
+def _PA_sweeps(indptr, indices, data, diag, states, energies, temp, num_sweeps):
+    """
+    num_sweeps Metropolis sweeps at temperature temp on every replica (row of states), replicas in parallel.
+    Each thread draws from its own rng stream. energies is updated in place.
+    """
+    
+    R, N = states.shape
+    for r in nb.prange(R):
+        state = states[r]
+        for _ in range(num_sweeps):
+            for flip in range(N):
+                field = 0.
+                for p in range(indptr[flip], indptr[flip+1]):
+                    if state[indices[p]]:
+                        field += data[p]
+                delta_E = (1 - 2*state[flip]) * (2 * field + diag[flip])
+                if np.random.binomial(1, np.minimum(np.exp(-delta_E/temp), 1.)):
+                    state[flip] ^= True
+                    energies[r] += delta_E
+
+
+# %%
+@nb.njit(parallel=True)
+def _PA_energies(indptr, indices, data, diag, states):
+    """
+    Energies of every replica (row of states).
+    """
+    
+    R, N = states.shape
+    energies = np.zeros(R)
+    for r in nb.prange(R):
+        for i in range(N):
+            if states[r, i]:
+                energies[r] += diag[i]
+                for p in range(indptr[i], indptr[i+1]):
+                    if states[r, indices[p]]:
+                        energies[r] += data[p]
+    return energies
+
+
+# %%
+def _resample(log_weights, rng):
+    """
+    Systematic resampling. Returns the number of copies of each replica; they sum up to the population size.
+    """
+    
+    R = len(log_weights)
+    w = np.exp(log_weights - np.max(log_weights))
+    cum = np.cumsum(w / np.sum(w))
+    cum[-1] = 1.
+    picks = np.searchsorted(cum, (rng.random() + np.arange(R)) / R)
+    return np.bincount(picks, minlength=R)
+
+
+# %%
+@nb.njit(parallel=False)
+def _seed_numba(sd):
+    """
+    Seeds the rng used inside compiled functions, which is separate from numpy's.
+    """
+    
+    np.random.seed(sd)
+
+
+# %%
+def one_PA_run(Q, temp_schedule, R, num_sweeps=1, sd=None, return_stats=False, checkpoint=None, resume=None):
+    """
+    One population annealing run over the full temperature schedule.
+    A population of R replicas starts from uniformly random states (equilibrium at infinite temperature).
+    At every temperature, the population is reweighted by the Boltzmann factors of the temperature change, resampled,
+    and then equilibrated by num_sweeps Metropolis sweeps per replica, with the replicas run in parallel threads.
+    
+    Parameters:
+        Q (2-D array or scipy.sparse matrix of float64): The matrix representing the local and coupling field of the problem.
+        temp_schedule (list[float64]): The annealing temperature schedule, e.g. from default_temp_schedule.
+                                       The number of resampling steps is implicitly the length of temp_schedule.
+        R (int): Population size.
+        num_sweeps (int, default=1): Number of Metropolis sweeps per replica at each temperature.
+        sd (default=None): Seed for numpy.random.default_rng(), used for the initial states and for resampling.
+                           The per-thread rng streams of the compiled sweeps are reseeded from it at every temperature,
+                           so sd fixes the whole run (exactly only with a single thread).
+        return_stats (bool, default=False): True to return a dict of run statistics additionally:
+            'step', 'temp', 'mean_energy', 'min_energy' (also as 'energy'): per temperature, after the sweeps.
+            'free_energy': estimate of the free energy F = -T ln Z per temperature, from the mean reweighting factors.
+            'num_families': number of distinct initial replicas with descendants left.
+            'rho_t': R times the sum of squared family fractions; small compared to R means the population is well equilibrated.
+            'max_family_frac': fraction of the population descending from the largest family.
+        checkpoint (Checkpointer or None, default=None): If not None, the population and rng state are saved every checkpoint.intv temperatures
+                                                         (see Utilities/checkpoint.py). As the compiled rng is reseeded from rng
+                                                         before every set of sweeps, a resumed run repeats the uninterrupted one.
+        resume (dict or None, default=None): A checkpoint from load_checkpoint to continue the run from.
+                                             All other arguments should be the same as in the interrupted run.
+    
+    Return: state with the lowest energy in the final population (1-D array of bool), (stats (dict))
+    """
+    
+    rng = np.random.default_rng(seed=sd)
+    
+    indptr, indices, data, diag = sparse_neighbour_lists(Q if issparse(Q) else csr_matrix(Q))
+    N = diag.shape[0]
+    temp_schedule = np.asarray(temp_schedule, dtype=np.float64)
+    num_steps = len(temp_schedule)
+    
+    states = rng.random((R, N)) < 0.5
+    energies = _PA_energies(indptr, indices, data, diag, states)
+    families = np.arange(R)
+    log_Z = N * np.log(2) # infinite temperature
+    beta = 0.
+    k0 = 0
+    if resume is not None:
+        k0, beta, log_Z = resume['step'], resume['beta'], resume['log_Z']
+        states, energies, families = resume['states'].copy(), resume['energies'].copy(), resume['families'].copy()
+        rng.bit_generator.state = resume['rng']
+    
+    if return_stats:
+        mean_energy = np.zeros(num_steps)
+        min_energy = np.zeros(num_steps)
+        free_energy = np.zeros(num_steps)
+        num_families = np.zeros(num_steps, dtype=np.int64)
+        rho_t = np.zeros(num_steps)
+        max_family_frac = np.zeros(num_steps)
+        start_time = time.perf_counter()
+    
+    for k in range(k0, num_steps):
+        temp = temp_schedule[k]
+        # reweight from the previous temperature and resample
+        log_weights = -(1/temp - beta) * energies
+        beta = 1/temp
+        counts = _resample(log_weights, rng)
+        
+        # copy-free where possible: survivors stay in place, only duplicates are written into the slots of removed replicas
+        dst = np.flatnonzero(counts == 0)
+        src = np.repeat(np.arange(R), np.maximum(counts - 1, 0))
+        states[dst] = states[src]
+        energies[dst] = energies[src]
+        families[dst] = families[src]
+        
+        _seed_numba(rng.integers(2**31))
+        _PA_sweeps(indptr, indices, data, diag, states, energies, temp, num_sweeps)
+        
+        shift = np.max(log_weights)
+        log_Z += shift + np.log(np.mean(np.exp(log_weights - shift)))
+        if return_stats:
+            family_sizes = np.bincount(families, minlength=R)
+            mean_energy[k] = np.mean(energies)
+            min_energy[k] = np.min(energies)
+            free_energy[k] = -temp * log_Z
+            num_families[k] = np.count_nonzero(family_sizes)
+            rho_t[k] = np.sum(family_sizes.astype(np.float64)**2) / R
+            max_family_frac[k] = np.max(family_sizes) / R
+        
+        if checkpoint is not None and checkpoint.due(k):
+            checkpoint.save(k+1, states=states, energies=energies, families=families, beta=beta, log_Z=log_Z,
+                            rng=rng.bit_generator.state)
+    
+    if checkpoint is not None:
+        checkpoint.wait()
+    best_state = states[np.argmin(energies)].copy()
+    
+    if return_stats:
+        total_time = time.perf_counter() - start_time
+        return best_state, {
+            'solver': 'PA',
+            'stats_intv': 1,
+            'step': np.arange(1, num_steps+1),
+            'temp': temp_schedule,
+            'mean_energy': mean_energy,
+            'min_energy': min_energy,
+            'energy': min_energy, # same name as the other solvers' energy samples
+            'free_energy': free_energy,
+            'num_families': num_families,
+            'rho_t': rho_t,
+            'max_family_frac': max_family_frac,
+            'num_proposals': (num_steps - k0) * num_sweeps * R * N, # after resume, only the resumed part is counted
+            'time': total_time,
+            'flips_per_sec': (num_steps - k0) * num_sweeps * R * N / total_time,
+        }
+    return best_state
+
+
+# %%
+Q = np.array([[-1., 0., 0., 0.], [0., 1., 0., 0.], [0., 0., 1., 0.], [0., 0., 0., 1.]])
+TS = default_temp_schedule(100, 300., 0.1)
+
+
+# %%
+# With numba, first pass
+start_time = time.time()
+ans = one_PA_run(Q, TS, 1000, sd=0)
+total_time = time.time() - start_time
+print(f'ground state: {ans}; time: {total_time} s')
+
+
+# %%
+# With numba, second pass
+start_time = time.time()
+ans = one_PA_run(Q, TS, 1000, sd=0)
+total_time = time.time() - start_time
+print(f'ground state: {ans}; time: {total_time} s')
+
+
+# %%
+
+
+
@@ -7,6 +7,7 @@
 import numpy as np
 import numba as nb
 import time
+from scipy.sparse import csr_matrix, issparse
 
 
 # %%
@@ -57,38 +58,337 @@ def default_temp_schedule(num_iter, temp_start, decay_rate, mode='EXPONENTIAL'):
 
 # %%
 @nb.njit(parallel=False)
-def one_SA_run(Q, temp_schedule, ansatz_state=None):
+def _SA_kernel(Q, temp_schedule, ansatz_state=None, stats=None, stats_intv=1):
     """
-    One simulated annealing run over the full temperature schedule.
+    Compiled loop of one_SA_run. Q is assumed symmetric. If stats is not None, it is filled in place with one row per window of stats_intv steps:
+    (number of proposals, number of accepted flips, sum of temperatures, energy at the end of the window).
+    """
+    
+    N = Q.shape[0]
+    
+    if ansatz_state is None:
+        state = (np.random.binomial(1, 0.5, N) == 1)
+    else:
+        state = ansatz_state
+    
+    if stats is not None:
+        energy = 0.
+        for i in range(N): # row by row, so that Q is never copied
+            if state[i]:
+                energy += np.sum(Q[i][state])
+    
+    for k, temp in enumerate(temp_schedule):
+        flip = np.random.randint(N)
+        delta_E = 2 * (1 - 2*state[flip]) * np.sum(Q[flip][state]) + Q[flip, flip]
+        accepted = np.random.binomial(1, np.minimum(np.exp(-delta_E/temp), 1.))
+        if accepted:
+            state[flip] ^= True
+        
+        if stats is not None: # pruned at compile time when stats is None
+            w = k // stats_intv
+            stats[w, 0] += 1
+            stats[w, 2] += temp
+            if accepted:
+                stats[w, 1] += 1
+                energy += delta_E
+            stats[w, 3] = energy
+    
+    return state
+
+
+# %%
+def sparse_neighbour_lists(Q):
+    """
+    Splits a sparse matrix into the neighbour lists used by the sparse solvers.
     
     Parameters:
-        Q (2-D array of float64): The matrix representing the local and coupling field of the problem.
-        temp_schedule (list[float64]): The annealing temperature schedule.
-                                       The number of iterations is implicitly the length of temp_schedule.
-        ansatz_state (1-D array of bool, default=None): The boolean vector representing the initial state.
-                                                        If None, a random state is chosen.
+        Q (scipy.sparse matrix of float64): The matrix representing the local and coupling field of the problem.
     
-    Return: final_state (1-D array of bool)
+    Return: indptr, indices, data (CSR arrays of the symmetrized off-diagonal couplings), diag (1-D array of float64, local fields)
     """
     
-    # Q_coef[i][j]: local field of i if i==j; coupling strength if i!=j
-    Q = 0.5*(Q + Q.T) # making sure Q is symmetric
-    N = Q.shape[0]
+    Q = csr_matrix(0.5*(Q + Q.T), dtype=np.float64) # making sure Q is symmetric
+    diag = Q.diagonal()
+    Q.setdiag(0)
+    Q.eliminate_zeros()
+    Q.sort_indices()
+    return Q.indptr, Q.indices, Q.data, diag
+
+
+# %%
+@nb.njit(parallel=False)
+def _SA_sparse_kernel(indptr, indices, data, diag, temp_schedule, ansatz_state=None, stats=None, stats_intv=1):
+    """
+    Compiled loop of one_SA_run for sparse Q given as neighbour lists.
+    Keeps field[i] = sum(Q[i, j] for j != i if state[j]), so a proposal costs O(1) and an accepted flip O(degree).
+    stats is filled as in _SA_kernel.
+    """
+    
+    N = diag.shape[0]
     
     if ansatz_state is None:
         state = (np.random.binomial(1, 0.5, N) == 1)
     else:
         state = ansatz_state
     
-    for temp in temp_schedule:
+    field = np.zeros(N)
+    for i in range(N):
+        for p in range(indptr[i], indptr[i+1]):
+            if state[indices[p]]:
+                field[i] += data[p]
+    
+    if stats is not None:
+        energy = 0.
+        for i in range(N):
+            if state[i]:
+                energy += diag[i] + field[i]
+    
+    for k, temp in enumerate(temp_schedule):
         flip = np.random.randint(N)
-        delta_E = 2 * (1 - 2*state[flip]) * np.sum(Q[flip][state]) + Q[flip, flip]
-        if np.random.binomial(1, np.minimum(np.exp(-delta_E/temp), 1.)):
+        sgn = 1 - 2*state[flip] # +1 if the bit is switched on, -1 if switched off
+        delta_E = sgn * (2 * field[flip] + diag[flip])
+        accepted = np.random.binomial(1, np.minimum(np.exp(-delta_E/temp), 1.))
+        if accepted:
             state[flip] ^= True
+            for p in range(indptr[flip], indptr[flip+1]):
+                field[indices[p]] += sgn * data[p]
+        
+        if stats is not None: # pruned at compile time when stats is None
+            w = k // stats_intv
+            stats[w, 0] += 1
+            stats[w, 2] += temp
+            if accepted:
+                stats[w, 1] += 1
+                energy += delta_E
+            stats[w, 3] = energy
     
     return state
 
 
+# %%
+@nb.njit(parallel=False)
+def _greedy_coloring(indptr, indices):
+    """
+    Greedy colouring of the coupling graph, visiting spins in order of decreasing degree.
+    """
+    
+    N = indptr.shape[0] - 1
+    order = np.argsort(indptr[:-1] - indptr[1:], kind='mergesort') # stable, so equal degrees keep their index order
+    color = -np.ones(N, dtype=np.int64)
+    forbidden = -np.ones(N+1, dtype=np.int64) # forbidden[c] == v if colour c is taken by a neighbour of v
+    for v in order:
+        for p in range(indptr[v], indptr[v+1]):
+            c = color[indices[p]]
+            if c >= 0:
+                forbidden[c] = v
+        c = 0
+        while forbidden[c] == v:
+            c += 1
+        color[v] = c
+    return color
+
+
+# %%
+def greedy_coloring(Q):
+    """
+    Partitions the spins into colour classes such that no two spins of a class are coupled.
+    On a bipartite lattice, such as the 2-D toroidal grids with even side length, this is the checkerboard.
+    Compute it once per problem and pass it to one_SA_run with sweep=True.
+    
+    Parameters:
+        Q (scipy.sparse matrix of float64): The matrix representing the local and coupling field of the problem.
+    
+    Return: color_ptr (1-D array of int), color_spins (1-D array of int)
+            The spins of colour c are color_spins[color_ptr[c]:color_ptr[c+1]].
+    """
+    
+    indptr, indices, _, _ = sparse_neighbour_lists(Q)
+    color = _greedy_coloring(indptr, indices)
+    color_spins = np.argsort(color, kind='stable')
+    color_ptr = np.concatenate(([0], np.cumsum(np.bincount(color))))
+    return color_ptr, color_spins
+
+
+# %%
+@nb.njit(parallel=True)
+def _SA_sweep_kernel(indptr, indices, data, diag, color_ptr, color_spins, temp_schedule, ansatz_state=None, stats=None, stats_intv=1):
+    """
+    Compiled loop of one_SA_run with sweep=True. Each temperature is one sweep over all spins, colour class by colour class.
+    Spins of one class share no coupling, so they are updated in parallel, each thread drawing from its own rng stream,
+    and each local field is read from neighbours of other classes in O(degree). stats is filled as in _SA_kernel.
+    """
+    
+    N = diag.shape[0]
+    num_colors = color_ptr.shape[0] - 1
+    
+    if ansatz_state is None:
+        state = (np.random.binomial(1, 0.5, N) == 1)
+    else:
+        state = ansatz_state
+    
+    if stats is not None:
+        energy = 0.
+        for i in range(N):
+            if state[i]:
+                energy += diag[i]
+                for p in range(indptr[i], indptr[i+1]):
+                    if state[indices[p]]:
+                        energy += data[p]
+    
+    for k, temp in enumerate(temp_schedule):
+        num_accepted = 0
+        sweep_delta_E = 0.
+        for c in range(num_colors):
+            for q in nb.prange(color_ptr[c], color_ptr[c+1]):
+                flip = color_spins[q]
+                field = 0.
+                for p in range(indptr[flip], indptr[flip+1]):
+                    if state[indices[p]]:
+                        field += data[p]
+                delta_E = (1 - 2*state[flip]) * (2 * field + diag[flip])
+                if np.random.binomial(1, np.minimum(np.exp(-delta_E/temp), 1.)):
+                    state[flip] ^= True
+                    num_accepted += 1
+                    sweep_delta_E += delta_E
+        
+        if stats is not None: # pruned at compile time when stats is None
+            w = k // stats_intv
+            stats[w, 0] += N
+            stats[w, 1] += num_accepted
+            stats[w, 2] += temp * N
+            energy += sweep_delta_E
+            stats[w, 3] = energy
+    
+    return state
+
+
+# %%
+@nb.njit(parallel=False)
+def _seed_numba(sd):
+    """
+    Seeds the rng used inside compiled functions, which is separate from numpy's.
+    """
+    
+    np.random.seed(sd)
+
+
+# %%
+def _SA_chunks(kernel, problem, Q_len, temp_schedule, state, stats, stats_intv, checkpoint, resume):
+    """
+    Runs kernel over the schedule in chunks of checkpoint.intv steps and saves a checkpoint after each full chunk.
+    The rng of compiled functions cannot be saved, so it is reseeded from base_seed at the start of every chunk instead.
+    A resumed run therefore draws the same random numbers as an uninterrupted one.
+    (For the parallel sweep kernel this only holds with a single thread.)
+    """
+    
+    if resume is not None:
+        k0, state, base_seed, intv = resume['step'], resume['state'].copy(), resume['base_seed'], resume['intv']
+    else:
+        k0, base_seed, intv = 0, np.random.randint(2**31), checkpoint.intv
+        if state is None:
+            state = (np.random.binomial(1, 0.5, Q_len) == 1)
+    if checkpoint is not None and checkpoint.intv != intv:
+        raise ValueError("checkpoint.intv differs from the interrupted run")
+    if stats is not None and intv % stats_intv != 0:
+        raise ValueError("checkpoint intv should be a multiple of stats_intv")
+    
+    for lo in range(k0, len(temp_schedule), intv):
+        hi = min(lo + intv, len(temp_schedule))
+        _seed_numba(base_seed + lo)
+        if stats is None:
+            state = kernel(*problem, temp_schedule[lo:hi], state)
+        else:
+            state = kernel(*problem, temp_schedule[lo:hi], state, stats[lo // stats_intv:], stats_intv)
+        if checkpoint is not None and checkpoint.due(hi-1):
+            checkpoint.save(hi, state=state, base_seed=base_seed, intv=intv)
+    
+    if checkpoint is not None:
+        checkpoint.wait()
+    return state
+
+
+# %%
+def one_SA_run(Q, temp_schedule, ansatz_state=None, return_stats=False, stats_intv=1000, sweep=False, coloring=None, checkpoint=None, resume=None):
+    """
+    One simulated annealing run over the full temperature schedule.
+    
+    Parameters:
+        Q (2-D array of float64): The matrix representing the local and coupling field of the problem.
+                                  A np.memmap (e.g. a .npy file opened with mmap_mode='r') is used in place, without copying it into memory,
+                                  and must therefore already be symmetric. It must be float32 or float64: the float16 and int8 files
+                                  of save_coupling in sb.py are not supported here, as int8 ones would be annealed without their scale.
+                                  A scipy.sparse matrix is annealed on neighbour lists, at O(degree) cost per accepted flip.
+        temp_schedule (list[float64]): The annealing temperature schedule.
+                                       The number of iterations is implicitly the length of temp_schedule.
+        ansatz_state (1-D array of bool, default=None): The boolean vector representing the initial state.
+                                                        If None, a random state is chosen.
+        return_stats (bool, default=False): True to return a dict of run statistics additionally.
+                                            The counters are only compiled into the loop when requested.
+        stats_intv (int, default=1000): The number of iterations per statistics window.
+        sweep (bool, default=False): If True, every temperature in temp_schedule is one full sweep over the spins instead of one random proposal.
+                                     The sweep visits the colour classes of a graph colouring in turn and updates each class in parallel
+                                     (thread count set by numba.set_num_threads). Q must be a scipy.sparse matrix.
+        coloring (tuple or None, default=None): The output of greedy_coloring(Q), computed once per problem and reused across runs.
+                                                Required with sweep=True.
+        checkpoint (Checkpointer or None, default=None): If not None, the state is saved every checkpoint.intv steps (see Utilities/checkpoint.py).
+                                                         The compiled rng is then reseeded at every checkpoint from a seed drawn from numpy.random.
+        resume (dict or None, default=None): A checkpoint from load_checkpoint to continue the run from.
+                                             All other arguments should be the same as in the interrupted run.
+    
+    Return: final_state (1-D array of bool), (stats (dict))
+    """
+    
+    # Q_coef[i][j]: local field of i if i==j; coupling strength if i!=j
+    if sweep:
+        if not issparse(Q):
+            raise ValueError("sweep requires a sparse Q")
+        if coloring is None:
+            raise ValueError("sweep requires coloring=greedy_coloring(Q)")
+        kernel = _SA_sweep_kernel
+        problem = sparse_neighbour_lists(Q) + coloring
+    elif issparse(Q):
+        kernel = _SA_sparse_kernel
+        problem = sparse_neighbour_lists(Q)
+    else:
+        kernel = _SA_kernel
+        if isinstance(Q, np.memmap):
+            if Q.dtype not in (np.float32, np.float64):
+                raise ValueError("a memory-mapped Q must be float32 or float64; convert float16 or int8 files (and apply the .scale of int8 ones) first")
+        else:
+            Q = 0.5*(Q + Q.T) # making sure Q is symmetric
+        problem = (Q,)
+    temp_schedule = np.asarray(temp_schedule, dtype=np.float64)
+    
+    chunked = checkpoint is not None or resume is not None
+    
+    if not return_stats:
+        if chunked:
+            return _SA_chunks(kernel, problem, Q.shape[0], temp_schedule, ansatz_state, None, stats_intv, checkpoint, resume)
+        return kernel(*problem, temp_schedule, ansatz_state)
+    
+    stats = np.zeros((-(-len(temp_schedule) // stats_intv), 4))
+    start_time = time.perf_counter()
+    if chunked:
+        state = _SA_chunks(kernel, problem, Q.shape[0], temp_schedule, ansatz_state, stats, stats_intv, checkpoint, resume)
+    else:
+        state = kernel(*problem, temp_schedule, ansatz_state, stats, stats_intv)
+    total_time = time.perf_counter() - start_time
+    
+    num_prop = stats[:, 0]
+    return state, {
+        'solver': 'SA',
+        'stats_intv': stats_intv,
+        'step': np.cumsum(num_prop).astype(np.int64),
+        'temp': stats[:, 2] / np.maximum(num_prop, 1), # mean temperature of the window
+        'accept_rate': stats[:, 1] / np.maximum(num_prop, 1),
+        'energy': stats[:, 3],
+        'num_proposals': int(np.sum(num_prop)),
+        'num_accepted': int(np.sum(stats[:, 1])),
+        'time': total_time,
+        'flips_per_sec': float(np.sum(num_prop)) / total_time,
+    }
+
+
 # %%
 Q = np.array([[-1., 0., 0., 0.], [0., 1., 0., 0.], [0., 0., 1., 0.], [0., 0., 0., 1.]])
 ansatz = np.zeros(4, dtype=np.bool_)
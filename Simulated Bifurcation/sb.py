@@ -12,178 +12,413 @@
 
 # %%
 import numpy as np
+import time
 
 
 # %%
-def one_aSB_run(J, PS, dt, c0, Kerr_coef=1., h=None, init_y=None, sd=None, return_x_history=False):
+class _SBStats:
+    """
+    Run statistics collected by the SB solvers when return_stats is True.
+    Records the time spent in the coupling matvec versus the rest of the step,
+    and, once every stats_intv steps, the energy of sign(x) and the fraction of clamped oscillators (|x| == 1).
+    """
+    
+    def __init__(self, j, num_iter, stats_intv):
+        self.j = j
+        self.num_iter = num_iter
+        self.stats_intv = stats_intv
+        num_win = -(-num_iter // stats_intv)
+        self.step = np.zeros(num_win, dtype=np.int64)
+        self.energy = np.zeros(num_win)
+        self.clamped_frac = np.zeros(num_win)
+        self.matvec_time = 0.
+        self.total_time = 0.
+        self.num_steps = 0
+    
+    def tic(self):
+        self._t0 = time.perf_counter()
+    
+    def matvec(self, j, x):
+        t = time.perf_counter()
+        jx = j @ x
+        self.matvec_time += time.perf_counter() - t
+        return jx
+    
+    def toc(self, k, x):
+        self.total_time += time.perf_counter() - self._t0
+        self.num_steps += 1
+        if (k+1) % self.stats_intv == 0 or k+1 == self.num_iter: # sampled outside of the timed region
+            w = k // self.stats_intv
+            sgn = np.sign(x)
+            self.step[w] = k+1
+            self.energy[w] = np.min(np.sum(sgn * (self.j @ sgn), axis=0)) # lowest among replicas
+            self.clamped_frac[w] = np.mean(np.abs(x) == 1)
+    
+    def to_dict(self, solver):
+        return {
+            'solver': solver,
+            'stats_intv': self.stats_intv,
+            'step': self.step,
+            'energy': self.energy, # energy of sign(x) including the local field, lowest among replicas
+            'clamped_frac': self.clamped_frac,
+            'time': self.total_time,
+            'time_split': {'matvec': self.matvec_time, 'update': self.total_time - self.matvec_time},
+            'steps_per_sec': self.num_steps / self.total_time,
+        }
+
+
+# %%
+def _SB_output(x, h, x_history=None, stats=None):
+    """
+    Final spin state of an SB run, followed by x_history and stats if they are not None.
+    """
+    
+    if h is None:
+        state = np.sign(x)
+    else:
+        state = np.sign(x[:-1]) * np.sign(x[-1])
+    state = state.T # one replica per row
+    
+    output = (state,) + tuple(a for a in (x_history, stats) if a is not None)
+    return output if len(output) > 1 else state
+
+
+# %%
+def save_coupling(J, file_path, dtype=np.float32, block_rows=4096):
+    """
+    Writes a dense coupling matrix to a .npy file that BlockedCoupling can stream from disk.
+    The copy is done block_rows rows at a time, so J itself may be a np.memmap larger than memory.
+    
+    Parameters:
+        J (2-D array of float): The matrix representing the coupling field of the problem.
+        file_path (str): The path of the .npy file.
+        dtype (numpy dtype, default=np.float32): Storage format. One of np.float64, np.float32, np.float16 or np.int8.
+                                                 For np.int8, J is scaled to [-127, 127] and the scale is stored in file_path + '.scale'.
+        block_rows (int, default=4096): Number of rows copied at once.
+    
+    Return: scale (float); J is approximately scale * (stored matrix)
+    """
+    
+    dtype = np.dtype(dtype)
+    if dtype not in (np.float64, np.float32, np.float16, np.int8):
+        raise ValueError("dtype not supported")
+    
+    N = J.shape[0]
+    scale = 1.
+    if dtype == np.int8:
+        scale = max(np.max(np.abs(J[lo:lo+block_rows])) for lo in range(0, N, block_rows)) / 127
+        scale = float(scale) if scale > 0 else 1.
+        with open(file_path + '.scale', 'w') as f:
+            f.write(repr(scale))
+    
+    out = np.lib.format.open_memmap(file_path, mode='w+', dtype=dtype, shape=J.shape)
+    for lo in range(0, N, block_rows):
+        block = np.asarray(J[lo:lo+block_rows], dtype=np.float64)
+        if dtype == np.int8:
+            block = np.rint(block / scale)
+        out[lo:lo+block_rows] = block
+    out.flush()
+    del out
+    
+    return scale
+
+
+# %%
+class BlockedCoupling:
+    """
+    Dense coupling matrix kept on disk (memory-mapped .npy written by save_coupling) and multiplied in row blocks.
+    Each product J @ x reads every block once into a fixed float64 buffer of block_rows rows,
+    so a 2-D x (one replica per column) costs the same disk traffic as a single vector.
+    The solvers only use shape and the @ operator, so a BlockedCoupling can be passed wherever J is expected.
+    """
+    
+    def __init__(self, file_path, block_rows=1024):
+        self.data = np.load(file_path, mmap_mode='r')
+        self.scale = 1.
+        if self.data.dtype == np.int8:
+            with open(file_path + '.scale', 'r') as f:
+                self.scale = float(f.read())
+        self.block_rows = block_rows
+        self.h = None
+        self._buf = np.empty((min(block_rows, self.data.shape[0]), self.data.shape[1]))
+    
+    @property
+    def shape(self):
+        N = self.data.shape[0]
+        return (N, N) if self.h is None else (N+1, N+1)
+    
+    def with_local_field(self, h):
+        """
+        The (N+1, N+1) coupling with h folded into an extra spin, as done for dense J in the SB solvers.
+        """
+        
+        out = BlockedCoupling.__new__(BlockedCoupling)
+        out.__dict__.update(self.__dict__)
+        out.h = np.asarray(h, dtype=np.float64)
+        return out
+    
+    def __matmul__(self, x):
+        x = np.asarray(x, dtype=np.float64)
+        N = self.data.shape[0]
+        xs = x[:N]
+        out = np.empty((N,) + x.shape[1:])
+        for lo in range(0, N, self.block_rows):
+            hi = min(lo + self.block_rows, N)
+            buf = self._buf[:hi-lo]
+            np.copyto(buf, self.data[lo:hi], casting='unsafe')
+            np.dot(buf, xs, out=out[lo:hi])
+        if self.scale != 1.:
+            out *= self.scale
+        if self.h is None:
+            return out
+        # extra spin couples to every spin with 0.5*h
+        return np.concatenate((out + 0.5 * np.multiply.outer(self.h, x[N]), [0.5 * self.h.dot(xs)]))
+
+
+# %%
+def _with_local_field(J, h):
+    """
+    Folds the local field h into J with an extra spin: (N+1, N+1) matrix with 0.5*h in its last row and column.
+    """
+    
+    if h is None:
+        return J
+    if isinstance(J, BlockedCoupling):
+        return J.with_local_field(h)
+    j = np.zeros((J.shape[0]+1, J.shape[1]+1))
+    j[:-1, :-1] = J
+    j[:-1, -1] = 0.5*h
+    j[-1, :-1] = 0.5*h.T
+    return j
+
+
+# %%
+def one_aSB_run(J, PS, dt, c0, Kerr_coef=1., h=None, init_y=None, sd=None, return_x_history=False, return_stats=False, stats_intv=100, num_rep=None, checkpoint=None, resume=None):
     """
     One (adiabatic) simulated bifurcation run over the full pump schedule.
     Angular frequency (a0) is set to 1 and absorbed into PS, dt and c0.
     Objective: Minimize J.dot(state).dot(state) + h.dot(state)
     
     Parameters:
-        J (2-D array of float): The matrix representing the coupling field of the problem.
+        J (2-D array of float or BlockedCoupling): The matrix representing the coupling field of the problem.
+                                                  A BlockedCoupling keeps J on disk and streams it in row blocks.
         PS (list[float]): The pump strength at each step. Number of iterations is implicitly len(PS).
         dt (float): Time step for the discretized time.
         c0 (float): Positive coupling strength scaling factor.
         Kerr_coef (float, default=1.): The Kerr coefficient.
         h (1-D array of float or None, default=None): The vector representing the local field of the problem.
-        init_y (1-D array of float or None, default=None): Initial y. If None, then random numbers between 0.1 and -0.1 are chosen.
+        init_y (1-D or 2-D array of float or None, default=None): Initial y. If None, then random numbers between 0.1 and -0.1 are chosen.
+                                                                 A 2-D array of shape (N, R), or (N+1, R) if h is given, runs R replicas in one batch,
+                                                                 sharing each product with J between them.
         sd (int or None, default=None): Seed for rng of init_y.
         return_x_history (bool, default=False): True to return history of x additionally.
+        return_stats (bool, default=False): True to return a dict of run statistics additionally.
+        stats_intv (int, default=100): The number of steps per statistics window.
+        num_rep (int or None, default=None): Number of replicas run in one batch when init_y is None. If None, a single run.
+        checkpoint (Checkpointer or None, default=None): If not None, x and y are saved every checkpoint.intv steps.
+                                                         See Utilities/checkpoint.py.
+        resume (dict or None, default=None): A checkpoint from load_checkpoint to continue the run from.
+                                             All other arguments should be the same as in the interrupted run.
     
-    Return: final_state (1-D array of float)
+    Return: final_state (1-D array of float, or 2-D array with one replica per row), (x_history (list[array of float])), (stats (dict))
     """
     
-    if h is None:
-        j = J
-    else:
-        j = np.zeros((J.shape[0]+1, J.shape[1]+1))
-        j[:-1, :-1] = J
-        j[:-1, -1] = 0.5*h
-        j[-1, :-1] = 0.5*h.T
-    
-    x = np.zeros(j.shape[0])
+    j = _with_local_field(J, h)
 
     if init_y is None:
         np.random.seed(sd)
-        y = np.random.uniform(-0.1, 0.1, j.shape[0])
+        y = np.random.uniform(-0.1, 0.1, j.shape[:1] if num_rep is None else (j.shape[0], num_rep))
     else:
         y = init_y.copy()
     
+    x = np.zeros(y.shape)
+    
+    k0 = 0
+    if resume is not None:
+        k0, x, y = resume['step'], resume['x'].copy(), resume['y'].copy()
+    
     if return_x_history:
         x_history = []
+    
+    if return_stats:
+        recorder = _SBStats(j, len(PS), stats_intv)
 
-    for a in PS:
+    for k in range(k0, len(PS)):
+        a = PS[k]
+        if return_stats:
+            recorder.tic()
         x += y * dt
-        y -= (Kerr_coef * x**3 + (1 - a) * x + 2 * c0 * j @ x) * dt
+        if return_stats:
+            jx = recorder.matvec(j, x)
+        else:
+            jx = j @ x
+        y -= (Kerr_coef * x**3 + (1 - a) * x + 2 * c0 * jx) * dt
         
         if return_x_history:
             x_history.append(x.copy()) # for analysis purposes
+        if return_stats:
+            recorder.toc(k, x)
+        if checkpoint is not None and checkpoint.due(k):
+            checkpoint.save(k+1, x=x, y=y)
     
-    if h is None:
-        return np.sign(x)
-    else:
-        return np.sign(x[:-1]) * np.sign(x[-1])
+    if checkpoint is not None:
+        checkpoint.wait()
+    
+    return _SB_output(x, h, x_history if return_x_history else None, recorder.to_dict('aSB') if return_stats else None)
 
 
 # %%
-def one_bSB_run(J, PS, dt, c0, h=None, init_y=None, sd=None, return_x_history=False):
+def one_bSB_run(J, PS, dt, c0, h=None, init_y=None, sd=None, return_x_history=False, return_stats=False, stats_intv=100, num_rep=None, checkpoint=None, resume=None):
     """
     One ballistic simulated bifurcation run over the full pump schedule.
     Angular frequency (a0) is set to 1 and absorbed into PS, dt and c0.
     Objective: Minimize J.dot(state).dot(state) + h.dot(state)
     
     Parameters:
-        J (2-D array of float): The matrix representing the coupling field of the problem.
+        J (2-D array of float or BlockedCoupling): The matrix representing the coupling field of the problem.
+                                                  A BlockedCoupling keeps J on disk and streams it in row blocks.
         PS (list[float]): The pump strength at each step. Number of iterations is implicitly len(PS).
         dt (float): Time step for the discretized time.
         c0 (float): Positive coupling strength scaling factor.
         h (1-D array of float or None, default=None): The vector representing the local field of the problem.
-        init_y (1-D array of float or None, default=None): Initial y. If None, then random numbers between 0.1 and -0.1 are chosen.
+        init_y (1-D or 2-D array of float or None, default=None): Initial y. If None, then random numbers between 0.1 and -0.1 are chosen.
+                                                                 A 2-D array of shape (N, R), or (N+1, R) if h is given, runs R replicas in one batch,
+                                                                 sharing each product with J between them.
         sd (int or None, default=None): Seed for rng of init_y.
         return_x_history (bool, default=False): True to return history of x additionally.
+        return_stats (bool, default=False): True to return a dict of run statistics additionally.
+        stats_intv (int, default=100): The number of steps per statistics window.
+        num_rep (int or None, default=None): Number of replicas run in one batch when init_y is None. If None, a single run.
+        checkpoint (Checkpointer or None, default=None): If not None, x and y are saved every checkpoint.intv steps.
+                                                         See Utilities/checkpoint.py.
+        resume (dict or None, default=None): A checkpoint from load_checkpoint to continue the run from.
+                                             All other arguments should be the same as in the interrupted run.
     
-    Return: final_state (1-D array of float)
+    Return: final_state (1-D array of float, or 2-D array with one replica per row), (x_history (list[array of float])), (stats (dict))
     """
     
-    if h is None:
-        j = J
-    else:
-        j = np.zeros((J.shape[0]+1, J.shape[1]+1))
-        j[:-1, :-1] = J
-        j[:-1, -1] = 0.5*h
-        j[-1, :-1] = 0.5*h.T
-    
-    x = np.zeros(j.shape[0])
+    j = _with_local_field(J, h)
 
     if init_y is None:
         np.random.seed(sd)
-        y = np.random.uniform(-0.1, 0.1, j.shape[0])
+        y = np.random.uniform(-0.1, 0.1, j.shape[:1] if num_rep is None else (j.shape[0], num_rep))
     else:
         y = init_y.copy()
     
+    x = np.zeros(y.shape)
+    
+    k0 = 0
+    if resume is not None:
+        k0, x, y = resume['step'], resume['x'].copy(), resume['y'].copy()
+    
     if return_x_history:
         x_history = []
     
-    for a in PS:
+    if return_stats:
+        recorder = _SBStats(j, len(PS), stats_intv)
+    
+    for k in range(k0, len(PS)):
+        a = PS[k]
+        if return_stats:
+            recorder.tic()
         x += y * dt
-        y -= ((1 - a) * x + 2 * c0 * j @ x) * dt
-        for i in range(j.shape[0]): # parallelizable
-            if np.abs(x[i]) > 1:
-                x[i] = np.sign(x[i])
-                y[i] = 0
+        if return_stats:
+            jx = recorder.matvec(j, x)
+        else:
+            jx = j @ x
+        y -= ((1 - a) * x + 2 * c0 * jx) * dt
+        clamped = np.abs(x) > 1
+        x[clamped] = np.sign(x[clamped])
+        y[clamped] = 0
         
         if return_x_history:
             x_history.append(x.copy()) # for analysis purposes
+        if return_stats:
+            recorder.toc(k, x)
+        if checkpoint is not None and checkpoint.due(k):
+            checkpoint.save(k+1, x=x, y=y)
 
-    if h is None:
-        return np.sign(x)
-    else:
-        return np.sign(x[:-1]) * np.sign(x[-1])
+    if checkpoint is not None:
+        checkpoint.wait()
+    
+    return _SB_output(x, h, x_history if return_x_history else None, recorder.to_dict('bSB') if return_stats else None)
 
 
 # %%
-def one_dSB_run(J, PS, dt, c0, h=None, init_y=None, sd=None, return_x_history=False):
+def one_dSB_run(J, PS, dt, c0, h=None, init_y=None, sd=None, return_x_history=False, return_stats=False, stats_intv=100, num_rep=None, checkpoint=None, resume=None):
     """
     One discrete simulated bifurcation run over the full pump schedule.
     Angular frequency (a0) is set to 1 and absorbed into PS, dt and c0.
     Objective: Minimize J.dot(state).dot(state) + h.dot(state)
     
     Parameters:
-        J (2-D array of float): The matrix representing the coupling field of the problem.
+        J (2-D array of float or BlockedCoupling): The matrix representing the coupling field of the problem.
+                                                  A BlockedCoupling keeps J on disk and streams it in row blocks.
         PS (list[float]): The pump strength at each step. Number of iterations is implicitly len(PS).
         dt (float): Time step for the discretized time.
         c0 (float): Positive coupling strength scaling factor.
         h (1-D array of float or None, default=None): The vector representing the local field of the problem.
-        init_y (1-D array of float or None, default=None): Initial y. If None, then random numbers between 0.1 and -0.1 are chosen.
+        init_y (1-D or 2-D array of float or None, default=None): Initial y. If None, then random numbers between 0.1 and -0.1 are chosen.
+                                                                 A 2-D array of shape (N, R), or (N+1, R) if h is given, runs R replicas in one batch,
+                                                                 sharing each product with J between them.
         sd (int or None, default=None): Seed for rng of init_y.
         return_x_history (bool, default=False): True to return history of x additionally.
+        return_stats (bool, default=False): True to return a dict of run statistics additionally.
+        stats_intv (int, default=100): The number of steps per statistics window.
+        num_rep (int or None, default=None): Number of replicas run in one batch when init_y is None. If None, a single run.
+        checkpoint (Checkpointer or None, default=None): If not None, x and y are saved every checkpoint.intv steps.
+                                                         See Utilities/checkpoint.py.
+        resume (dict or None, default=None): A checkpoint from load_checkpoint to continue the run from.
+                                             All other arguments should be the same as in the interrupted run.
     
-    Return: final_state (1-D array of float)
+    Return: final_state (1-D array of float, or 2-D array with one replica per row), (x_history (list[array of float])), (stats (dict))
     """
     
-    if h is None:
-        j = J
-    else:
-        j = np.zeros((J.shape[0]+1, J.shape[1]+1))
-        j[:-1, :-1] = J
-        j[:-1, -1] = 0.5*h
-        j[-1, :-1] = 0.5*h.T
-    
-    x = np.zeros(j.shape[0])
+    j = _with_local_field(J, h)
 
     if init_y is None:
         np.random.seed(sd)
-        y = np.random.uniform(-0.1, 0.1, j.shape[0])
+        y = np.random.uniform(-0.1, 0.1, j.shape[:1] if num_rep is None else (j.shape[0], num_rep))
     else:
         y = init_y.copy()
     
+    x = np.zeros(y.shape)
+    
+    k0 = 0
+    if resume is not None:
+        k0, x, y = resume['step'], resume['x'].copy(), resume['y'].copy()
+    
     if return_x_history:
         x_history = []
     
-    for a in PS:
+    if return_stats:
+        recorder = _SBStats(j, len(PS), stats_intv)
+    
+    for k in range(k0, len(PS)):
+        a = PS[k]
         # PS = [a0*i/(steps-1) for i in range(steps)]
-        y -= ((1 - a) * x + 2 * c0 * j @ np.sign(x)) * dt
+        if return_stats:
+            recorder.tic()
+            jx = recorder.matvec(j, np.sign(x))
+        else:
+            jx = j @ np.sign(x)
+        y -= ((1 - a) * x + 2 * c0 * jx) * dt
         x += y * dt
-        for i in range(j.shape[0]): # parallelizable
-            if np.abs(x[i]) > 1:
-                x[i] = np.sign(x[i])
-                y[i] = 0
+        clamped = np.abs(x) > 1
+        x[clamped] = np.sign(x[clamped])
+        y[clamped] = 0
         
         if return_x_history:
             x_history.append(x.copy()) # for analysis purposes
+        if return_stats:
+            recorder.toc(k, x)
+        if checkpoint is not None and checkpoint.due(k):
+            checkpoint.save(k+1, x=x, y=y)
 
-    if return_x_history:
-        if h is None:
-            return np.sign(x), x_history
-        else:
-            return np.sign(x[:-1]) * np.sign(x[-1]), x_history
+    if checkpoint is not None:
+        checkpoint.wait()
     
-    if h is None:
-        return np.sign(x)
-    else:
-        return np.sign(x[:-1]) * np.sign(x[-1])
+    return _SB_output(x, h, x_history if return_x_history else None, recorder.to_dict('dSB') if return_stats else None)
 
 
 # %%
@@ -191,7 +426,6 @@ def main():
     """
     A simple showcase
     """
-    import time
 
     sd = 7
 
@@ -13,11 +13,12 @@
 
 # %%
 import numpy as np
+import time
 from scipy.sparse import block_diag
 
 
 # %%
-def one_SQA_run(J, h, trans_fld_sched, M, T, sd=None, init_state=None, return_pauli_z=False, return_z_hist=False):
+def one_SQA_run(J, h, trans_fld_sched, M, T, sd=None, init_state=None, return_pauli_z=False, return_z_hist=False, return_stats=False, stats_intv=100, checkpoint=None, resume=None):
     """
     One path-integral Monte Carlo simulated quantum annealing run over the full transverse field strength schedule.
     The goal is to find a state such that sum(J[i, j]*state[i]*state[j]) + sum(h[i]*state[i]) is minimized.
@@ -34,8 +35,14 @@ def one_SQA_run(J, h, trans_fld_sched, M, T, sd=None, init_state=None, return_pa
                                                      If None, a random state is chosen.
         return_pauli_z (bool, default=False): If True, returns a N-spin state averaged over the imaginary time dimension.
                                               If False, returns the raw N*M-spin state.
+        return_stats (bool, default=False): True to return a dict of run statistics additionally.
+        stats_intv (int, default=100): The number of sweeps per statistics window.
+        checkpoint (Checkpointer or None, default=None): If not None, the dynamic state and rng state are saved every checkpoint.intv sweeps.
+                                                         See Utilities/checkpoint.py.
+        resume (dict or None, default=None): A checkpoint from load_checkpoint to continue the run from.
+                                             All other arguments should be the same as in the interrupted run.
     
-    Return: final_state (1-D array of int)
+    Return: final_state (1-D array of int), (stats (dict))
     """
     rng = np.random.default_rng(seed=sd)
 
@@ -58,12 +65,27 @@ def one_SQA_run(J, h, trans_fld_sched, M, T, sd=None, init_state=None, return_pa
     else:
         state = np.tile(init_state, M)
     
+    k0 = 0
+    if resume is not None:
+        k0 = resume['step']
+        state = resume['state'].copy()
+        rng.bit_generator.state = resume['rng']
+    
     if return_z_hist:
         z_hist = []
     
+    if return_stats:
+        num_win = -(-len(trans_fld_sched) // stats_intv)
+        accepted = np.zeros(num_win, dtype=np.int64)
+        slice_energy = np.zeros(num_win) # lowest problem energy among the Trotter slices
+        field_time = 0.
+        rng_time = 0.
+        start_time = time.perf_counter()
+    
     # print(j.shape[0])
 
-    for Gamma in trans_fld_sched:
+    for k in range(k0, len(trans_fld_sched)):
+        Gamma = trans_fld_sched[k]
         Jp_coef = -0.5 * T * np.log(np.tanh(Gamma / M / T))
         
         # First design (Tohoku)
@@ -72,9 +94,23 @@ def one_SQA_run(J, h, trans_fld_sched, M, T, sd=None, init_state=None, return_pa
             # delta_E -= -4 * Jp_coef * Jp_terms[flip].dot(state)
             # delta_E += -2 * h_extended[flip]
             # delta_E *= state[flip]
+            if return_stats:
+                t0 = time.perf_counter()
             delta_E = -4 * (j[flip] - Jp_coef * Jp_terms[flip]).dot(state) * state[flip] - 2 * h_extended[flip] * state[flip]
-            if rng.binomial(1, np.minimum(np.exp(-delta_E/T), 1.)):
+            if return_stats:
+                t1 = time.perf_counter()
+            flipped = rng.binomial(1, np.minimum(np.exp(-delta_E/T), 1.))
+            if return_stats:
+                t2 = time.perf_counter()
+                field_time += t1 - t0
+                rng_time += t2 - t1
+                accepted[k // stats_intv] += bool(flipped)
+            if flipped:
                 state[flip] *= -1
+        
+        if return_stats and ((k+1) % stats_intv == 0 or k+1 == len(trans_fld_sched)):
+            slices = np.reshape(np.array(state), (M, -1))
+            slice_energy[k // stats_intv] = np.min(np.sum((J @ slices.T).T * slices, axis=1) + slices.dot(h)) # J may be sparse
 
         # # Second design (PRB.66.094203)
         # # Local move
@@ -93,19 +129,49 @@ def one_SQA_run(J, h, trans_fld_sched, M, T, sd=None, init_state=None, return_pa
 
         if return_z_hist:
             z_hist.append(np.sum(np.reshape(np.array(state), (M, -1)), axis=0) / M)
+        
+        if checkpoint is not None and checkpoint.due(k):
+            checkpoint.save(k+1, state=state, rng=rng.bit_generator.state)
+    
+    if checkpoint is not None:
+        checkpoint.wait()
     
     if return_z_hist:
-        return z_hist
-    if return_pauli_z:
-        return np.sum(np.reshape(np.array(state), (M, -1)), axis=0) / M
+        output = z_hist
+    elif return_pauli_z:
+        output = np.sum(np.reshape(np.array(state), (M, -1)), axis=0) / M
     else:
-        return state
+        output = state
+    
+    if return_stats:
+        total_time = time.perf_counter() - start_time
+        num_sweeps = len(trans_fld_sched)
+        win_len = np.minimum(stats_intv, num_sweeps - stats_intv * np.arange(num_win))
+        return output, {
+            'solver': 'SQA',
+            'stats_intv': stats_intv,
+            'step': np.minimum(stats_intv * np.arange(1, num_win+1), num_sweeps),
+            'accept_rate': accepted / (win_len * N * M),
+            'energy': slice_energy,
+            'num_proposals': (num_sweeps - k0) * N * M, # after resume, only the resumed part is counted
+            'num_accepted': int(np.sum(accepted)),
+            'time': total_time,
+            'time_split': {'field': field_time, 'rng': rng_time, 'other': total_time - field_time - rng_time},
+            'flips_per_sec': (num_sweeps - k0) * N * M / total_time,
+        }
+    return output
 
 
 # %%
-def one_CTQMC_run(J, h, trans_fld_sched, T, sd=None, init_state=None, return_z_history=False):
+def one_CTQMC_run(J, h, trans_fld_sched, T, sd=None, init_state=None, return_z_history=False, checkpoint=None, resume=None):
     """
     One SQA run with continuous-time Monte Carlo method.
+    
+    Parameters:
+        checkpoint (Checkpointer or None, default=None): If not None, the dynamic state and rng state are saved every checkpoint.intv steps of trans_fld_sched.
+                                                         See Utilities/checkpoint.py.
+        resume (dict or None, default=None): A checkpoint from load_checkpoint to continue the run from.
+                                             All other arguments should be the same as in the interrupted run.
 
     Return: pauli_z observables
     """
@@ -183,10 +249,18 @@ def one_CTQMC_run(J, h, trans_fld_sched, T, sd=None, init_state=None, return_z_h
                 if len(cuts_val[i]) > 1:
                     cuts_val[i].pop(j)
     
+    k0 = 0
+    if resume is not None:
+        k0 = resume['step']
+        cuts_pos = [resume['cuts_pos'][lo:hi].tolist() for lo, hi in zip(resume['cuts_pos_ptr'][:-1], resume['cuts_pos_ptr'][1:])]
+        cuts_val = [resume['cuts_val'][lo:hi].tolist() for lo, hi in zip(resume['cuts_val_ptr'][:-1], resume['cuts_val_ptr'][1:])]
+        rng.bit_generator.state = resume['rng']
+    
     if return_z_history:
         z_hist = []
 
-    for Gamma in trans_fld_sched:
+    for step in range(k0, len(trans_fld_sched)):
+        Gamma = trans_fld_sched[step]
         for i in range(N):
             # Is the length of imaginary time 1 or beta? -> beta
 
@@ -247,6 +321,17 @@ def one_CTQMC_run(J, h, trans_fld_sched, T, sd=None, init_state=None, return_z_h
         
         if return_z_history:
             z_hist.append(np.array([sum_spin(i)/beta for i in range(N)]))
+        
+        if checkpoint is not None and checkpoint.due(step):
+            # worldlines are ragged, stored flattened with offsets
+            checkpoint.save(step+1, rng=rng.bit_generator.state,
+                            cuts_pos=np.array([t for c in cuts_pos for t in c], dtype=np.float64),
+                            cuts_pos_ptr=np.cumsum([0] + [len(c) for c in cuts_pos]),
+                            cuts_val=np.array([v for c in cuts_val for v in c], dtype=np.int64),
+                            cuts_val_ptr=np.cumsum([0] + [len(c) for c in cuts_val]))
+    
+    if checkpoint is not None:
+        checkpoint.wait()
     
     if return_z_history:
         return z_hist
@@ -254,7 +339,7 @@ def one_CTQMC_run(J, h, trans_fld_sched, T, sd=None, init_state=None, return_z_h
 
 
 # %%
-def one_SD_run(J, h, trans_fld_sched, T, sd=None, return_x_history=False, dt=0.1):
+def one_SD_run(J, h, trans_fld_sched, T, sd=None, return_x_history=False, dt=0.1, checkpoint=None, resume=None):
     """
     One annealing based on classical spin dynamics run over the full transverse field strength schedule.
     Each spin is represented as a classical spin on the x-z plane. The state variables are the inclination angles with the z-axis.
@@ -271,6 +356,10 @@ def one_SD_run(J, h, trans_fld_sched, T, sd=None, return_x_history=False, dt=0.1
         sd (default=None): Seed for numpy.random.
         return_x_history (bool, default=False): True to return history of x additionally.
         dt (float, default=0.1): The time step. Only in use when T=0.
+        checkpoint (Checkpointer or None, default=None): If not None, the dynamic state and rng state are saved every checkpoint.intv steps.
+                                                         See Utilities/checkpoint.py.
+        resume (dict or None, default=None): A checkpoint from load_checkpoint to continue the run from.
+                                             All other arguments should be the same as in the interrupted run.
     
     Return: final_state (1-D array of int)
     """
@@ -284,6 +373,13 @@ def one_SD_run(J, h, trans_fld_sched, T, sd=None, return_x_history=False, dt=0.1
 
     state = 1.5 * np.pi * np.ones(N)
     
+    k0 = 0
+    if resume is not None:
+        k0 = resume['step']
+        state = resume['state'].copy()
+        rng_state = resume['rng']
+        np.random.set_state((rng_state[0], np.array(rng_state[1], dtype=np.uint32)) + tuple(rng_state[2:]))
+    
     x_history = []
     # Numerical solution to the equations of motion
     # if T == 0:
@@ -296,12 +392,20 @@ def one_SD_run(J, h, trans_fld_sched, T, sd=None, return_x_history=False, dt=0.1
 
     # Metropolis-type update
     # else:
-    for Gamma in trans_fld_sched:
+    for k in range(k0, len(trans_fld_sched)):
+        Gamma = trans_fld_sched[k]
         new_state = 2 * np.pi * np.random.rand(N)
         delta_E = (j.dot(np.cos(state)) + h) * (np.cos(new_state) - np.cos(state)) + Gamma * (np.sin(new_state) - np.sin(state))
         accepted = np.random.binomial(1, np.minimum(np.exp(-delta_E/T), 1.))
         state = new_state * accepted + state * (1 - accepted)
         x_history.append(state.copy())
+        
+        if checkpoint is not None and checkpoint.due(k):
+            rng_state = np.random.get_state()
+            checkpoint.save(k+1, state=state, rng=[rng_state[0], rng_state[1].tolist()] + list(rng_state[2:]))
+    
+    if checkpoint is not None:
+        checkpoint.wait()
     
     if return_x_history:
         return np.sign(np.cos(state)), x_history
@@ -313,7 +417,6 @@ def main():
     """
     A simple showcase
     """
-    import time
     import matplotlib.pyplot as plt
 
     sd = 7
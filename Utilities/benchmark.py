@@ -0,0 +1,412 @@
+# To add a new cell, type '# %%'
+# To add a new markdown cell, type '# %% [markdown]'
+# %% [markdown]
+# Throughput microbenchmarks of the solver kernels, for detecting performance regressions between versions.
+# 
+# Every case times one hot loop in isolation on random problems of increasing size, dense and sparse, and for the
+# numba-parallel kernels at several thread counts. Setup outside the loop (symmetrising, neighbour lists, colouring,
+# schedules) is done before the clock starts; where a solver keeps its loop inside one_*_run (PT dense, SB, SQA, CTQMC),
+# the run function is timed. The solver files are loaded by path, so this file only needs the repo layout.
+# 
+# Cases: SA proposal/accept (dense, sparse, colour-class sweep), PT sweep+exchange, aSB/bSB/dSB step, SQA sweep,
+# CTQMC update and PA sweeps. Digital Annealing and Momentum Annealing exist only as notebooks, so they are not covered.
+# 
+# Results are lists of dicts, one row per (case, mode, N, threads), saved to and loaded from CSV.
+# compare_results() lists the rows of a new run that are slower, or use more memory, than a saved baseline.
+
+# %%
+import numpy as np
+import numba as nb
+import scipy.sparse as sp
+import argparse
+import csv
+import ctypes
+import importlib.util
+import os
+import time
+import tracemalloc
+
+
+# %%
+_REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_MODULES = {}
+
+def _load_solver(rel_path):
+    """
+    Imports a solver file (e.g. 'Simulated Annealing/sa.py') by path, once.
+    Note that sa.py, pt.py and pa.py run their small demo cells on import.
+    """
+    
+    if rel_path not in _MODULES:
+        name = '_bench_' + os.path.splitext(os.path.basename(rel_path))[0]
+        spec = importlib.util.spec_from_file_location(name, os.path.join(_REPO, rel_path))
+        mod = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(mod)
+        _MODULES[rel_path] = mod
+    return _MODULES[rel_path]
+
+
+# %%
+def random_problem(N, sparse, degree=6, sd=0):
+    """
+    Random Ising problem with Gaussian couplings and local fields.
+    
+    Parameters:
+        N (int): Number of spins.
+        sparse (bool): If True, J is a scipy.sparse csr matrix with about degree neighbours per spin; else a dense fully connected J.
+        degree (int, default=6): Mean number of neighbours per spin when sparse.
+        sd (default=None): Seed for numpy.random.default_rng().
+    
+    Return: J (symmetric with zero diagonal), h (1-D array of float64)
+    """
+    
+    rng = np.random.default_rng(seed=sd)
+    h = rng.standard_normal(N)
+    if sparse:
+        rows = np.repeat(np.arange(N), degree // 2)
+        cols = rng.integers(N, size=rows.shape[0])
+        keep = rows != cols
+        J = sp.coo_matrix((rng.standard_normal(np.count_nonzero(keep)), (rows[keep], cols[keep])), shape=(N, N)).tocsr()
+        J = (J + J.T).tocsr()
+    else:
+        J = rng.standard_normal((N, N)) / np.sqrt(N)
+        J += J.T
+        np.fill_diagonal(J, 0.)
+    return J, h
+
+
+def _qubo(J, h):
+    return (J + sp.diags(h)).tocsr() if sp.issparse(J) else J + np.diag(h)
+
+
+# %%
+# Each case sets up one hot loop and returns run (a function of no arguments), the number of steps it takes
+# and the number of single-spin updates (proposals, or oscillator/variable updates) in those steps.
+
+def _case_SA(J, h, sparse, num_steps):
+    sa = _load_solver('Simulated Annealing/sa.py')
+    Q = _qubo(J, h)
+    TS = np.asarray(sa.default_temp_schedule(num_steps, 10., 1e-5), dtype=np.float64)
+    state = np.random.default_rng(seed=0).random(Q.shape[0]) < 0.5
+    if sparse:
+        lists = sa.sparse_neighbour_lists(Q)
+        run = lambda: sa._SA_sparse_kernel(*lists, TS, state.copy())
+    else:
+        run = lambda: sa._SA_kernel(Q, TS, state.copy())
+    return run, num_steps, num_steps
+
+
+def _case_SA_sweep(J, h, sparse, num_steps):
+    sa = _load_solver('Simulated Annealing/sa.py')
+    Q = _qubo(J, h)
+    TS = np.asarray(sa.default_temp_schedule(num_steps, 10., 0.01), dtype=np.float64)
+    state = np.random.default_rng(seed=0).random(Q.shape[0]) < 0.5
+    problem = sa.sparse_neighbour_lists(Q) + sa.greedy_coloring(Q)
+    run = lambda: sa._SA_sweep_kernel(*problem, TS, state.copy())
+    return run, num_steps, num_steps * Q.shape[0]
+
+
+def _case_PT(J, h, sparse, num_steps, M=8, re_intv=10):
+    pt = _load_solver('Parallel Tempering/pt.py')
+    Q = _qubo(J, h)
+    temp_seq = np.geomspace(0.1, 10., M)
+    state = np.random.default_rng(seed=0).random(Q.shape[0]) < 0.5
+    if sparse:
+        lists = pt.sparse_neighbour_lists(Q)
+        run = lambda: pt._PT_sparse_kernel(*lists, num_steps, re_intv, temp_seq, np.tile(state, (M, 1)))
+    else:
+        run = lambda: pt.one_PT_run(Q, num_steps, re_intv, temp_seq, ansatz_state=state.copy())
+    return run, num_steps, num_steps * M
+
+
+def _case_SB(variant):
+    def case(J, h, sparse, num_steps):
+        sb = _load_solver('Simulated Bifurcation/sb.py')
+        one_run = getattr(sb, f'one_{variant}_run')
+        PS = np.linspace(0., 1., num_steps)
+        c0 = 0.5 / np.sqrt(J.shape[0])
+        run = lambda: one_run(J, PS, 0.5, c0, sd=0) # without h, which would add a dense row and column to J
+        return run, num_steps, num_steps * J.shape[0]
+    return case
+
+
+def _case_SQA(J, h, sparse, num_steps, M=4):
+    sqa = _load_solver('Simulated Quantum Annealing/sqa.py')
+    TFS = np.linspace(2., 0.01, num_steps)
+    run = lambda: sqa.one_SQA_run(J, h, TFS, M, 0.05, sd=0)
+    return run, num_steps, num_steps * J.shape[0] * M
+
+
+def _case_CTQMC(J, h, sparse, num_steps):
+    sqa = _load_solver('Simulated Quantum Annealing/sqa.py')
+    TFS = np.linspace(2., 0.01, num_steps)
+    run = lambda: sqa.one_CTQMC_run(J, h, TFS, 0.5, sd=0)
+    return run, num_steps, num_steps * J.shape[0]
+
+
+def _case_PA(J, h, sparse, num_steps, R=32):
+    pa = _load_solver('Population Annealing/pa.py')
+    lists = pa.sparse_neighbour_lists(_qubo(J, h))
+    states = np.random.default_rng(seed=0).random((R, J.shape[0])) < 0.5
+    energies = pa._PA_energies(*lists, states)
+    run = lambda: pa._PA_sweeps(*lists, states.copy(), energies.copy(), 1., num_steps)
+    return run, num_steps, num_steps * R * J.shape[0]
+
+
+# name: (case, modes, parallel, default number of steps, largest N)
+# The largest N keeps the Python-loop solvers, and SQA with its dense (N M, N M) Trotter couplings, to a few seconds per case.
+CASES = {
+    'SA': (_case_SA, ('dense', 'sparse'), False, 1000000, None),
+    'SA_sweep': (_case_SA_sweep, ('sparse',), True, 20, None),
+    'PT': (_case_PT, ('dense', 'sparse'), False, 10000, None),
+    'aSB': (_case_SB('aSB'), ('dense', 'sparse'), False, 100, None),
+    'bSB': (_case_SB('bSB'), ('dense', 'sparse'), False, 100, None),
+    'dSB': (_case_SB('dSB'), ('dense', 'sparse'), False, 100, None),
+    'SQA': (_case_SQA, ('dense', 'sparse'), False, 2, 500),
+    'CTQMC': (_case_CTQMC, ('dense',), False, 2, 100),
+    'PA': (_case_PA, ('sparse',), True, 5, None),
+}
+
+
+# %%
+def _rss_peak_reset():
+    """
+    Resets the peak resident set size of this process (Linux only). Returns False where that is not possible.
+    """
+    
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _fix_mmap_threshold():
+    """
+    Makes glibc serve every allocation of 128 kB or more by mmap and unmap it when freed (Linux only).
+    By default the threshold grows after large frees, and later arrays then reuse heap pages that are already resident,
+    so the rise of the resident set size during a run would miss them.
+    """
+    
+    try:
+        ctypes.CDLL(None).mallopt(-3, 128 * 1024) # M_MMAP_THRESHOLD
+    except (OSError, AttributeError):
+        pass
+
+
+def _rss_kb(field):
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+
+
+def _measure(run, repeat):
+    """
+    Runs run() repeat times and returns the best wall time and the peak memory of the first run on top of the memory in use before it,
+    so the interpreter, the libraries and the problem data are not counted.
+    On Linux this is the rise of the resident set size high-water mark, which includes memory allocated inside compiled kernels
+    (with _fix_mmap_threshold, arrays of 128 kB or more are counted exactly; smaller allocations may reuse resident pages).
+    Elsewhere it is the tracemalloc peak (numpy and Python allocations only).
+    """
+    
+    use_rss = _rss_peak_reset()
+    if use_rss:
+        base = _rss_kb('VmRSS')
+    else:
+        tracemalloc.start()
+    
+    times = []
+    for r in range(repeat):
+        start_time = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start_time)
+        if r == 0:
+            if use_rss:
+                peak = 1024 * max(_rss_kb('VmHWM') - base, 0)
+            else:
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+    
+    return min(times), peak
+
+
+# %%
+def run_benchmarks(cases=None, sizes=(100, 1000, 10000, 100000), modes=('dense', 'sparse'), threads=(1,),
+                   num_steps=None, repeat=3, max_dense_N=4096, degree=6, verbose=True):
+    """
+    Runs the throughput benchmarks.
+    
+    Parameters:
+        cases (list[str] or None, default=None): Names from CASES. If None, all of them.
+        sizes (list[int], default=(100, 1000, 10000, 100000)): Problem sizes N. Sizes above the largest N of a case are skipped.
+        modes (list[str], default=('dense', 'sparse')): 'dense' for fully connected J, 'sparse' for J with about degree neighbours per spin.
+        threads (list[int], default=(1,)): numba thread counts for the parallel cases (SA_sweep, PA); the other cases run once.
+                                           Counts above numba.config.NUMBA_NUM_THREADS are skipped.
+        num_steps (dict or None, default=None): Steps per case, overriding the defaults in CASES.
+        repeat (int, default=3): Timed runs per row; the fastest one is reported.
+        max_dense_N (int, default=4096): Largest N of dense problems (8 N^2 bytes per matrix).
+        degree (int, default=6): Mean number of neighbours per spin of sparse problems.
+        verbose (bool, default=True): Print every row when done.
+    
+    Return: results (list[dict]), one row per (case, mode, N, threads) with
+            'steps_per_sec', 'spin_updates_per_sec', 'time' (best of repeat, in s), 'peak_mem' (bytes allocated during the run, see _measure)
+            and 'parallel_eff' (speed over threads times the speed with one thread, for the parallel cases)
+    """
+    
+    num_steps = num_steps or {}
+    cases = list(CASES) if cases is None else cases
+    results = []
+    _fix_mmap_threshold()
+    if verbose:
+        print(format_results([]))
+    
+    for name in cases:
+        case, case_modes, parallel, default_steps, max_N = CASES[name]
+        steps = num_steps.get(name, default_steps)
+        for mode in (m for m in modes if m in case_modes):
+            sparse = mode == 'sparse'
+            
+            # compile (or warm up) on a small problem first, so compilation is not timed
+            run, _, _ = case(*random_problem(16, sparse, degree), sparse, 2)
+            run()
+            
+            for N in sizes:
+                if (max_N is not None and N > max_N) or (not sparse and N > max_dense_N):
+                    continue
+                J, h = random_problem(N, sparse, degree)
+                run, num_done, num_updates = case(J, h, sparse, steps)
+                
+                base_speed = None
+                for t in (threads if parallel else (1,)):
+                    if t > nb.config.NUMBA_NUM_THREADS:
+                        continue
+                    if parallel:
+                        nb.set_num_threads(t)
+                    best, peak = _measure(run, repeat)
+                    row = {
+                        'case': name,
+                        'mode': mode,
+                        'N': N,
+                        'threads': t,
+                        'steps': num_done,
+                        'time': best,
+                        'steps_per_sec': num_done / best,
+                        'spin_updates_per_sec': num_updates / best,
+                        'peak_mem': peak,
+                        'parallel_eff': np.nan,
+                    }
+                    if parallel:
+                        if t == 1:
+                            base_speed = row['spin_updates_per_sec']
+                        if base_speed is not None:
+                            row['parallel_eff'] = row['spin_updates_per_sec'] / (t * base_speed)
+                    results.append(row)
+                    if verbose:
+                        print(format_results([row], header=False), flush=True)
+                
+                if parallel:
+                    nb.set_num_threads(nb.config.NUMBA_NUM_THREADS)
+    
+    return results
+
+
+# %%
+_COLUMNS = ('case', 'mode', 'N', 'threads', 'steps', 'time', 'steps_per_sec', 'spin_updates_per_sec', 'peak_mem', 'parallel_eff')
+
+def format_results(results, header=True):
+    """
+    Formats benchmark results as a plain-text table.
+    """
+    
+    lines = ["".join(f"{key:>22}" for key in _COLUMNS)] if header else []
+    for row in results:
+        lines.append("".join(f"{row[key]:>22.6g}" if isinstance(row[key], float) else f"{row[key]:>22}" for key in _COLUMNS))
+    return "\n".join(lines)
+
+
+def save_results(results, file_path):
+    """
+    Saves benchmark results as CSV, one row per (case, mode, N, threads).
+    """
+    
+    with open(file_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=_COLUMNS)
+        writer.writeheader()
+        writer.writerows(results)
+
+
+def load_results(file_path):
+    """
+    Reads benchmark results saved by save_results.
+    """
+    
+    with open(file_path, newline='') as f:
+        return [{key: (val if key in ('case', 'mode') else int(val) if key in ('N', 'threads', 'steps') else float(val))
+                 for key, val in row.items()} for row in csv.DictReader(f)]
+
+
+def compare_results(baseline, results, tolerance=0.1, mem_tolerance=0.1, mem_slack=1<<20):
+    """
+    Finds regressions of results against baseline, matching rows by (case, mode, N, threads).
+    
+    Parameters:
+        baseline (list[dict]): Earlier results, e.g. from load_results.
+        results (list[dict]): New results.
+        tolerance (float, default=0.1): Relative slowdown of spin_updates_per_sec that is still accepted as noise.
+        mem_tolerance (float, default=0.1): Relative growth of peak_mem that is still accepted as noise.
+        mem_slack (int, default=1<<20): Growth of peak_mem in bytes that is always accepted, as small peaks depend on the allocator.
+    
+    Return: regressions (list[dict]) with the row keys, 'metric' ('spin_updates_per_sec' or 'peak_mem'), the old and new values and their ratio
+    """
+    
+    key = lambda row: (row['case'], row['mode'], row['N'], row['threads'])
+    old = {key(row): row for row in baseline}
+    regressions = []
+    for row in results:
+        if key(row) not in old:
+            continue
+        prev = old[key(row)]
+        ratio = row['spin_updates_per_sec'] / prev['spin_updates_per_sec']
+        if ratio < 1 - tolerance:
+            regressions.append(dict(zip(('case', 'mode', 'N', 'threads'), key(row)), metric='spin_updates_per_sec',
+                                    old=prev['spin_updates_per_sec'], new=row['spin_updates_per_sec'], ratio=ratio))
+        if row['peak_mem'] > prev['peak_mem'] * (1 + mem_tolerance) + mem_slack:
+            regressions.append(dict(zip(('case', 'mode', 'N', 'threads'), key(row)), metric='peak_mem',
+                                    old=prev['peak_mem'], new=row['peak_mem'], ratio=row['peak_mem'] / max(prev['peak_mem'], 1)))
+    return regressions
+
+
+# %%
+def main():
+    """
+    Runs the full suite with every available thread count.
+    Command line: python benchmark.py [baseline.csv] [-o results.csv]
+    The baseline is read before the run, so it can be the same file as the output; the output is only written with -o.
+    """
+    
+    parser = argparse.ArgumentParser(description="Throughput benchmarks of the solver kernels.")
+    parser.add_argument('baseline', nargs='?', help="results CSV of an earlier version to report regressions against")
+    parser.add_argument('-o', '--output', help="CSV file to save the results to")
+    args = parser.parse_args()
+    baseline = load_results(args.baseline) if args.baseline is not None else None
+    
+    threads = sorted({1, 2, 4, 8, nb.config.NUMBA_NUM_THREADS})
+    results = run_benchmarks(threads=threads)
+    if args.output is not None:
+        save_results(results, args.output)
+    
+    if baseline is not None:
+        regressions = compare_results(baseline, results)
+        for reg in regressions:
+            what, unit = ("slower", "spin updates/s") if reg['metric'] == 'spin_updates_per_sec' else ("more memory", "bytes")
+            print(f"{what}: {reg['case']} {reg['mode']} N={reg['N']} threads={reg['threads']}: "
+                  f"{reg['old']:.6g} -> {reg['new']:.6g} {unit} ({reg['ratio']:.2f}x)")
+        if not regressions:
+            print("no regressions")
+
+
+# %%
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# To add a new cell, type '# %%'
+# To add a new markdown cell, type '# %% [markdown]'
+# %% [markdown]
+# Periodic checkpointing for long solver runs.
+# 
+# The solvers take checkpoint=Checkpointer(file_path, intv) to save their dynamic state every intv steps
+# (position in the schedule, states/replicas/energies, SB x and y, CTQMC worldlines, rng state),
+# and resume=load_checkpoint(file_path) to continue a run from such a file.
+# A resumed run is called with the same arguments as the original one and ends in the same state as an uninterrupted run.
+# 
+# The solvers only call due(), save() and wait() on the checkpoint object, so they do not import this file.
+
+# %%
+import numpy as np
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+# %%
+class Checkpointer:
+    """
+    Writes checkpoints to one .npz file in a background thread, so the solver loop only pays for copying its state.
+    Every write goes to a temporary file that then replaces file_path, so an interrupted write never corrupts the last checkpoint.
+    At most one write is pending; save() waits for the previous write before handing over the next one.
+    
+    Parameters:
+        file_path (str): The path of the checkpoint file (.npz).
+        intv (int): The number of steps between checkpoints.
+    """
+    
+    def __init__(self, file_path, intv):
+        if intv <= 0:
+            raise ValueError("intv should be positive")
+        self.file_path = file_path
+        self.intv = intv
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending = None
+    
+    def due(self, step):
+        """
+        True if a checkpoint should be saved after completing step (0-based) of the schedule.
+        """
+        
+        return (step+1) % self.intv == 0
+    
+    def save(self, step, **state):
+        """
+        Saves the state reached after step steps of the schedule. Arrays are copied before returning.
+        Non-array entries (e.g. rng states and lists) are stored as JSON.
+        """
+        
+        record = {'step': np.int64(step)}
+        for key, val in state.items():
+            if isinstance(val, np.ndarray):
+                record[key] = val.copy()
+            elif np.isscalar(val):
+                record[key] = np.asarray(val)
+            else:
+                record['json_' + key] = np.asarray(json.dumps(val))
+        
+        self.wait()
+        self._pending = self._executor.submit(self._write, record)
+    
+    def _write(self, record):
+        tmp_path = self.file_path + '.tmp.npz'
+        np.savez(tmp_path, **record)
+        os.replace(tmp_path, self.file_path)
+    
+    def wait(self):
+        """
+        Blocks until the pending write, if any, is on disk.
+        """
+        
+        if self._pending is not None:
+            self._pending.result()
+            self._pending = None
+    
+    def close(self):
+        self.wait()
+        self._executor.shutdown()
+
+
+# %%
+def load_checkpoint(file_path):
+    """
+    Reads a checkpoint written by Checkpointer.
+    
+    Parameters:
+        file_path (str): The path of the checkpoint file (.npz).
+    
+    Return: checkpoint (dict); 'step' is the number of steps already done
+    """
+    
+    checkpoint = {}
+    with np.load(file_path) as f:
+        for key in f.files:
+            if key.startswith('json_'):
+                checkpoint[key[5:]] = json.loads(str(f[key]))
+            elif f[key].ndim == 0:
+                checkpoint[key] = f[key].item()
+            else:
+                checkpoint[key] = f[key]
+    return checkpoint
@@ -0,0 +1,180 @@
+# To add a new cell, type '# %%'
+# To add a new markdown cell, type '# %% [markdown]'
+# %% [markdown]
+# Batch evaluation of many spin/bit states against one problem.
+# 
+# Objectives (same conventions as the solvers):
+# - Ising: J.dot(state).dot(state) + h.dot(state), state in {-1, +1}
+# - QUBO: Q.dot(state).dot(state), state in {0, 1}
+# - MaxCut: total weight of the edges cut by the partition given by state
+# 
+# The problem matrix can be a dense numpy array (including np.memmap) or a scipy.sparse matrix.
+# States are given as a 2-D array with one state per row, or as bits packed with pack_states to save memory.
+
+# %%
+import numpy as np
+from scipy.sparse import issparse
+
+
+# %%
+def pack_states(states):
+    """
+    Packs states into bits, 8 spins per byte.
+    
+    Parameters:
+        states (2-D array of bool, or of int in {0, 1} or {-1, +1}): One state per row.
+    
+    Return: packed_states (2-D array of uint8)
+    """
+    
+    states = np.asarray(states)
+    return np.packbits(states > 0, axis=1)
+
+
+# %%
+def unpack_states(packed_states, num_bits):
+    """
+    Inverse of pack_states.
+    
+    Parameters:
+        packed_states (2-D array of uint8): The output of pack_states.
+        num_bits (int): Number of spins per state.
+    
+    Return: states (2-D array of bool)
+    """
+    
+    return np.unpackbits(packed_states, axis=1, count=num_bits).astype(np.bool_)
+
+
+# %%
+def _as_state_rows(states, num_bits, spin):
+    """
+    Turns states into a 2-D float array, in {-1, +1} if spin is True and in {0, 1} otherwise.
+    """
+    
+    if num_bits is not None:
+        states = unpack_states(states, num_bits)
+    if states.dtype == np.bool_:
+        return 2. * states - 1. if spin else states.astype(np.float64)
+    return states.astype(np.float64)
+
+
+# %%
+def _quadratic_forms(A, X, chunk_size):
+    """
+    Computes A.dot(x).dot(x) for every row x of X, chunk_size rows at a time.
+    """
+    
+    out = np.empty(X.shape[0])
+    for lo in range(0, X.shape[0], chunk_size):
+        x = X[lo:lo+chunk_size]
+        if issparse(A):
+            ax = (A @ x.T).T
+        else:
+            ax = x @ A.T
+        out[lo:lo+chunk_size] = np.einsum('ij,ij->i', ax, x)
+    return out
+
+
+# %%
+def _evaluate(fun, states, num_bits, spin, dedup):
+    """
+    Applies fun to the unique rows of states only and scatters the results back.
+    Duplicates are found before unpacking, so packed states are compared byte-wise.
+    """
+    
+    states = np.asarray(states)
+    if states.ndim == 1:
+        states = states[None, :]
+    if not dedup:
+        return fun(_as_state_rows(states, num_bits, spin))
+    uniq, inverse = np.unique(states, axis=0, return_inverse=True)
+    return fun(_as_state_rows(uniq, num_bits, spin))[inverse.reshape(-1)]
+
+
+# %%
+def ising_energies(J, states, h=None, num_bits=None, dedup=True, chunk_size=1024):
+    """
+    Ising energies J.dot(state).dot(state) + h.dot(state) of a batch of states.
+    
+    Parameters:
+        J (2-D array or scipy.sparse matrix of float): The matrix representing the coupling field of the problem.
+        states (2-D array): One state per row, in {-1, +1}, or bool with True for +1.
+                            A 1-D array is treated as a single state.
+        h (1-D array of float or None, default=None): The vector representing the local field of the problem.
+        num_bits (int or None, default=None): If not None, states are packed by pack_states and have num_bits spins.
+        dedup (bool, default=True): True to evaluate each distinct state only once.
+        chunk_size (int, default=1024): The number of states multiplied with J at once. Bounds the memory used.
+    
+    Return: energies (1-D array of float)
+    """
+    
+    def fun(X):
+        E = _quadratic_forms(J, X, chunk_size)
+        if h is not None:
+            E += X @ np.asarray(h, dtype=np.float64)
+        return E
+    
+    return _evaluate(fun, states, num_bits, True, dedup)
+
+
+# %%
+def qubo_energies(Q, states, num_bits=None, dedup=True, chunk_size=1024):
+    """
+    QUBO energies Q.dot(state).dot(state) of a batch of states.
+    
+    Parameters:
+        Q (2-D array or scipy.sparse matrix of float): The matrix representing the local and coupling field of the problem.
+        states (2-D array): One state per row, in {0, 1} or bool. A 1-D array is treated as a single state.
+        num_bits (int or None, default=None): If not None, states are packed by pack_states and have num_bits bits.
+        dedup (bool, default=True): True to evaluate each distinct state only once.
+        chunk_size (int, default=1024): The number of states multiplied with Q at once. Bounds the memory used.
+    
+    Return: energies (1-D array of float)
+    """
+    
+    fun = lambda X: _quadratic_forms(Q, X, chunk_size)
+    return _evaluate(fun, states, num_bits, False, dedup)
+
+
+# %%
+def _is_symmetric(A, chunk_size, rtol=1e-9, atol=1e-12):
+    """
+    True if A equals its transpose up to rounding, compared in blocks of chunk_size rows so a dense (or memory-mapped) A is not copied whole.
+    """
+    
+    if issparse(A):
+        diff = abs(A - A.T)
+        return diff.nnz == 0 or diff.max() <= atol + rtol * abs(A).max()
+    return all(np.allclose(A[lo:lo+chunk_size], A[:, lo:lo+chunk_size].T, rtol=rtol, atol=atol) for lo in range(0, A.shape[0], chunk_size))
+
+
+# %%
+def maxcut_values(W, states, num_bits=None, dedup=True, chunk_size=1024, symmetric=None):
+    """
+    MaxCut values of a batch of partitions, i.e. the total weight of edges (i, j) with state[i] != state[j].
+    
+    Parameters:
+        W (2-D array or scipy.sparse matrix of float): The weighted adjacency matrix of the graph.
+                                                      How edges are counted is set by symmetric.
+        states (2-D array): One partition per row, in {-1, +1}, or bool. A 1-D array is treated as a single state.
+        num_bits (int or None, default=None): If not None, states are packed by pack_states and have num_bits spins.
+        dedup (bool, default=True): True to evaluate each distinct state only once.
+        chunk_size (int, default=1024): The number of states multiplied with W at once. Bounds the memory used.
+        symmetric (bool or None, default=None):
+            True:  every edge is stored in both triangles, W[i, j] == W[j, i], and counted once.
+            False: entries (i, j) and (j, i) are added up, so each edge is stored once, e.g. in an upper-triangular W.
+            None:  True if W equals W.T up to rounding, else False.
+    
+    Return: cut_values (1-D array of float)
+    """
+    
+    total_weight = W.sum()
+    
+    # sum over i<j of (w_ij + w_ji) * (1 - s_i s_j) / 2; diagonal terms cancel
+    # for a symmetric W, w_ij + w_ji counts every edge twice
+    if symmetric is None:
+        symmetric = _is_symmetric(W, chunk_size)
+    scale = 0.25 if symmetric else 0.5
+    fun = lambda X: scale * (total_weight - _quadratic_forms(W, X, chunk_size))
+    return _evaluate(fun, states, num_bits, True, dedup)
@@ -0,0 +1,204 @@
+# To add a new cell, type '# %%'
+# To add a new markdown cell, type '# %% [markdown]'
+# %% [markdown]
+# Local search post-processing for solver outputs.
+# Objective: Minimize J.dot(state).dot(state) + h.dot(state), state in {-1, +1}
+# 
+# The states returned by SB (sign(x)), SD and SQA (averaged pauli_z) are often a few single flips away from a local minimum.
+# polish() takes a batch of such states and runs either a steepest descent or a short tabu search from each of them,
+# keeping the local fields up to date after every flip so that each move costs O(N) instead of O(N^2).
+# For a scipy.sparse J (e.g. G-set and rudy graphs) the field update after a flip costs only O(degree),
+# but choosing the best move still scans all N spins, so a move remains O(N).
+
+# %%
+import numpy as np
+import numba as nb
+from scipy.sparse import csr_matrix, diags, issparse
+
+
+# %%
+@nb.njit(parallel=False)
+def _local_fields(J, off, h, s):
+    """
+    g[i] = 2 * sum(J[i, j] * s[j] for j != i) + h[i], so that flipping spin i changes the energy by -2 * s[i] * g[i].
+    The couplings are either a dense J, with empty neighbour lists off, or the off-diagonal neighbour lists off = (indptr, indices, data),
+    with an empty J. J is assumed symmetric.
+    """
+    
+    indptr, indices, data = off
+    if indptr.shape[0] == 0:
+        return 2 * J.dot(s) - 2 * np.diag(J) * s + h
+    g = h.copy()
+    for i in range(s.shape[0]):
+        for p in range(indptr[i], indptr[i+1]):
+            g[i] += 2 * data[p] * s[indices[p]]
+    return g
+
+
+# %%
+@nb.njit(parallel=False)
+def _flip(J, off, s, g, k):
+    """
+    Flips spin k and updates the local fields g in place, in O(N) for a dense J and O(degree) for neighbour lists.
+    """
+    
+    s_k = s[k]
+    indptr, indices, data = off
+    if indptr.shape[0] == 0:
+        for i in range(s.shape[0]): # row k instead of column k, as J is symmetric
+            if i != k:
+                g[i] -= 4 * J[k, i] * s_k
+    else:
+        for p in range(indptr[k], indptr[k+1]):
+            g[indices[p]] -= 4 * data[p] * s_k
+    s[k] = -s_k
+
+
+# %%
+@nb.njit(parallel=False)
+def _energy(J, off, h, s):
+    """
+    s.dot(J.dot(s)) + h.dot(s); without the diagonal of J for neighbour lists.
+    """
+    
+    indptr, indices, data = off
+    if indptr.shape[0] == 0:
+        return s.dot(J.dot(s)) + h.dot(s)
+    energy = h.dot(s)
+    for i in range(s.shape[0]):
+        for p in range(indptr[i], indptr[i+1]):
+            energy += data[p] * s[i] * s[indices[p]]
+    return energy
+
+
+# %%
+@nb.njit(parallel=False)
+def _steepest_descent(J, off, h, s, max_iter):
+    """
+    Flips the spin with the largest energy decrease until no single flip decreases the energy.
+    Returns the change in energy.
+    """
+    
+    g = _local_fields(J, off, h, s)
+    delta = 0.
+    for _ in range(max_iter):
+        dE = -2 * s * g
+        k = np.argmin(dE)
+        if dE[k] >= 0:
+            break
+        delta += dE[k]
+        _flip(J, off, s, g, k)
+    return delta
+
+
+# %%
+@nb.njit(parallel=False)
+def _tabu_search(J, off, h, s, max_iter, tenure):
+    """
+    Tabu search: always takes the best non-tabu flip, even if it increases the energy.
+    A flipped spin stays tabu for the next tenure iterations unless flipping it would improve on the best energy found (aspiration).
+    s is overwritten with the best state found. Returns the change in energy.
+    """
+    
+    N = s.shape[0]
+    g = _local_fields(J, off, h, s)
+    tabu_until = np.zeros(N, dtype=np.int64)
+    best_s = s.copy()
+    delta = 0.
+    best_delta = 0.
+    for it in range(max_iter):
+        dE = -2 * s * g
+        k = -1
+        for i in range(N):
+            if tabu_until[i] > it and delta + dE[i] >= best_delta:
+                continue
+            if k < 0 or dE[i] < dE[k]:
+                k = i
+        if k < 0: # every move is tabu
+            break
+        delta += dE[k]
+        _flip(J, off, s, g, k)
+        tabu_until[k] = it + 1 + tenure
+        if delta < best_delta:
+            best_delta = delta
+            best_s[:] = s
+    s[:] = best_s
+    return best_delta
+
+
+# %%
+@nb.njit(parallel=True)
+def _polish_batch(J, off, h, states, method, max_iter, tenure):
+    """
+    Polishes every row of states in place. Returns the raw and polished energies.
+    """
+    
+    R = states.shape[0]
+    raw_energies = np.empty(R)
+    polished_energies = np.empty(R)
+    for r in nb.prange(R):
+        s = states[r]
+        raw_energies[r] = _energy(J, off, h, s)
+        if method == 0:
+            polished_energies[r] = raw_energies[r] + _steepest_descent(J, off, h, s, max_iter)
+        else:
+            polished_energies[r] = raw_energies[r] + _tabu_search(J, off, h, s, max_iter, tenure)
+    return raw_energies, polished_energies
+
+
+# %%
+def polish(J, states, h=None, method='GREEDY', max_iter=None, tabu_tenure=None):
+    """
+    Single-flip local search from each of a batch of states.
+    Objective: Minimize J.dot(state).dot(state) + h.dot(state)
+    
+    Parameters:
+        J (2-D array or scipy.sparse matrix of float): The matrix representing the coupling field of the problem.
+                                                       A sparse J is kept as neighbour lists, so the field update after a flip costs O(degree)
+                                                       (choosing the move is still O(N)).
+        states (1-D or 2-D array of float): One state per row, e.g. the output of one_dSB_run or one_SQA_run(return_pauli_z=True).
+                                            Entries are rounded to spins by their sign, with 0 mapped to +1.
+        h (1-D array of float or None, default=None): The vector representing the local field of the problem.
+        method (string, default='GREEDY'):
+            'GREEDY': Steepest descent, stops at the first local minimum.
+            'TABU':   Tabu search for max_iter flips, returns the best state visited.
+        max_iter (int or None, default=None): Maximum number of flips per state. If None, N for 'GREEDY' and 10*N for 'TABU'.
+        tabu_tenure (int or None, default=None): Number of iterations a flipped spin stays tabu. If None, N//10 + 1.
+    
+    Return: polished_states (array of float, same shape as states), raw_energies (1-D array of float), polished_energies (1-D array of float)
+    """
+    
+    if method not in ('GREEDY', 'TABU'):
+        raise ValueError("method not supported")
+    
+    if issparse(J):
+        j = csr_matrix(0.5*(J + J.T), dtype=np.float64) # making sure J is symmetric
+        diag = j.diagonal()
+        j = csr_matrix(j - diags(diag))
+        j.eliminate_zeros()
+        j.sort_indices()
+        dense, off = np.zeros((0, 0)), (j.indptr.astype(np.int64), j.indices.astype(np.int64), j.data)
+        offset = np.sum(diag) # constant s[i]**2 * J[i, i] terms left out of the neighbour lists
+    else:
+        J = np.asarray(J, dtype=np.float64)
+        dense, off = 0.5*(J + J.T), (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)) # making sure J is symmetric
+        offset = 0.
+    N = J.shape[0]
+    h = np.zeros(N) if h is None else np.asarray(h, dtype=np.float64)
+    
+    states = np.asarray(states)
+    single = (states.ndim == 1)
+    polished = np.where(np.atleast_2d(states) >= 0, 1., -1.)
+    
+    if max_iter is None:
+        max_iter = N if method == 'GREEDY' else 10 * N
+    if tabu_tenure is None:
+        tabu_tenure = N // 10 + 1
+    
+    raw_energies, polished_energies = _polish_batch(dense, off, h, polished, 0 if method == 'GREEDY' else 1, max_iter, tabu_tenure)
+    raw_energies += offset
+    polished_energies += offset
+    
+    if single:
+        return polished[0], raw_energies, polished_energies
+    return polished, raw_energies, polished_energies
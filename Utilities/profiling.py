@@ -0,0 +1,80 @@
+# To add a new cell, type '# %%'
+# To add a new markdown cell, type '# %% [markdown]'
+# %% [markdown]
+# Helpers for the run statistics returned by the solvers with return_stats=True.
+# 
+# The statistics are plain dicts of scalars and numpy arrays, with per-window entries sampled every stats_intv steps:
+# - SA (sa.py): accept_rate, temp, energy
+# - PT (pt.py): accept_rate per temperature, exchange_rate per neighbouring pair, energy of the best replica
+# - SB (sb.py): energy of sign(x), clamped_frac, time_split between the coupling matvec and the rest of the step
+# - SQA (sqa.py): accept_rate, energy of the best Trotter slice, time_split between field evaluation and rng
+# - PA (pa.py): one window per temperature with temp, mean_energy, energy of the best replica, free_energy and family statistics
+# 
+# Digital Annealing has no per-window acceptance rates: its solver exists only as code cells in Digital Annealing.ipynb,
+# with no .py module to add return_stats to.
+
+# %%
+import numpy as np
+import json
+
+
+# %%
+def stats_report(stats):
+    """
+    Formats run statistics as a plain-text profile report.
+    
+    Parameters:
+        stats (dict): The statistics returned by a solver with return_stats=True.
+    
+    Return: report (str)
+    """
+    
+    lines = [f"solver: {stats['solver']}"]
+    
+    for key in ('num_proposals', 'num_accepted', 'time', 'flips_per_sec', 'steps_per_sec'):
+        if key in stats:
+            lines.append(f"{key}: {stats[key]:.6g}")
+    
+    if 'time_split' in stats:
+        total = sum(stats['time_split'].values())
+        for key, t in stats['time_split'].items():
+            lines.append(f"time in {key}: {t:.6g} s ({100 * t / max(total, 1e-300):.1f}%)")
+    
+    if 'exchange_rate' in stats:
+        lines.append("exchange_rate: " + " ".join(f"{r:.3f}" for r in stats['exchange_rate']))
+    
+    # one row per statistics window
+    columns = [key for key in ('step', 'temp', 'accept_rate', 'clamped_frac', 'energy')
+               if key in stats and np.ndim(stats[key]) >= 1 and len(stats[key]) == len(stats['step'])]
+    lines.append("".join(f"{key:>16}" for key in columns))
+    for w in range(len(stats['step'])):
+        row = []
+        for key in columns:
+            val = stats[key][w]
+            if np.ndim(val): # e.g. PT acceptance rates per temperature, averaged over temperatures
+                val = np.mean(val)
+            row.append(f"{val:>16.6g}")
+        lines.append("".join(row))
+    
+    return "\n".join(lines)
+
+
+# %%
+def save_stats(stats, file_path):
+    """
+    Saves run statistics as a JSON record. Arrays are stored as (nested) lists.
+    
+    Parameters:
+        stats (dict): The statistics returned by a solver with return_stats=True.
+        file_path (str): The path of the output file.
+    """
+    
+    def to_builtin(val):
+        if isinstance(val, dict):
+            return {key: to_builtin(v) for key, v in val.items()}
+        if isinstance(val, (np.ndarray, np.generic)):
+            return val.tolist()
+        return val
+    
+    with open(file_path, 'w') as f:
+        json.dump(to_builtin(stats), f, indent=1)